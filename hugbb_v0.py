@@ -1,14 +1,76 @@
+import os
+import sys
+import time
+
+IMPORT_START = time.perf_counter()
+
+# 基准测试、离线导出和回放不需要真实窗口：在 pygame 初始化之前切到 SDL 的 dummy 视频驱动，
+# 并关掉 pygame 的欢迎信息，让终端输出就是纯 JSON。只在直接运行本文件时看命令行，被别的程序导入时不碰环境变量
+if __name__ == "__main__" and any(flag in sys.argv for flag in ("--benchmark", "--export", "--video", "--bake-atlas", "--replay")):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
 import pygame
 import math
-import sys
+import json
 import random
+import asyncio
+import weakref
+from collections import OrderedDict, deque
+
+try:
+    import numpy as np
+except ImportError:  # 没有 numpy 时退回逐个 Particle 对象
+    np = None
 
 # --- 1. 初始化 ---
-pygame.init()
+# import 本身不碰 pygame 的任何子系统：窗口在第一次要用时才打开 (app.display())，字体在第一次渲染文字时才初始化。
+# 不调用 pygame.init()，音频、手柄这些用不到的子系统一概不启动
 WIDTH, HEIGHT = 800, 750
-screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.SRCALPHA)
-pygame.display.set_caption("抱抱模拟器 - 温馨满屋版")
-clock = pygame.time.Clock()
+CAPTION = "抱抱模拟器 - 温馨满屋版"
+
+class App:
+    """窗口和时钟的持有者，记录启动各阶段的耗时 (毫秒)"""
+    def __init__(self, size=(WIDTH, HEIGHT), caption=CAPTION):
+        self.size = size
+        self.caption = caption
+        self.screen = None
+        self.clock = None
+        self.startup = {"import": None}
+
+    def measure(self, phase, fn, *args):
+        """执行 fn 并把耗时累加到 phase 上"""
+        start = time.perf_counter()
+        result = fn(*args)
+        self.startup[phase] = round(self.startup.get(phase, 0.0) + (time.perf_counter() - start) * 1000.0, 3)
+        return result
+
+    def display(self):
+        """需要时初始化显示子系统并打开窗口"""
+        if self.screen is None:
+            self.measure("display", self.open_window)
+        return self.screen
+
+    def open_window(self):
+        pygame.display.init()
+        self.screen = pygame.display.set_mode(self.size, pygame.SRCALPHA)
+        pygame.display.set_caption(self.caption)
+        self.clock = pygame.time.Clock()
+
+    def report(self):
+        return dict(self.startup)
+
+    def run(self, **options):
+        """打开窗口并进入主循环 (参数见 main_async)"""
+        self.display()
+        main(**options)
+
+    async def run_async(self, **options):
+        """网页版 (pygbag) 的入口：asyncio.run(app.run_async())"""
+        self.display()
+        await main_async(**options)
+
+app = App()
 
 # --- 2. 配色方案 (V8 高级配色 + 新增宠物植物配色) ---
 BG_WALL_COLOR = (120, 110, 105)
@@ -47,33 +109,327 @@ DUST_COLOR = (255, 240, 200)
 HEART_COLOR = (235, 80, 80)
 BUTTON_COLOR = (100, 170, 240)
 BUTTON_HOVER_COLOR = (120, 190, 255)
+BUTTON_PRESSED_COLOR = (80, 145, 215)
 TEXT_COLOR = (255, 255, 255)
 
 # --- 3. 辅助类 ---
 
+# 表面分配计数：性能面板用它显示每帧新分配了多少表面；total_* 是启动以来的累计 (内存诊断用)
+surface_stats = {"count": 0, "bytes": 0, "total_count": 0, "total_bytes": 0}
+
+def surface_bytes(surf):
+    return surf.get_width() * surf.get_height() * surf.get_bytesize()
+
+def track_surface(surf):
+    size = surface_bytes(surf)
+    surface_stats["count"] += 1
+    surface_stats["bytes"] += size
+    surface_stats["total_count"] += 1
+    surface_stats["total_bytes"] += size
+    return surf
+
+def new_surface(size, flags=0):
+    return track_surface(pygame.Surface(size, flags))
+
+def to_display_format(surf, alpha):
+    """转换为屏幕像素格式以加速 blit；还没有窗口时原样返回"""
+    if pygame.display.get_surface() is None:
+        return surf
+    return track_surface(surf.convert_alpha() if alpha else surf.convert())
+
+# 当前画质里影响烘焙结果的开关，由 QualityController 切换 (见第 9 节)
+quality_settings = {"smooth": True, "leaf_detail": True}
+
+def scale_surface(surf, size):
+    """smooth 打开时用 smoothscale 抗锯齿，弱机器上换成更快的 scale"""
+    scale = pygame.transform.smoothscale if quality_settings["smooth"] else pygame.transform.scale
+    return track_surface(scale(surf, size))
+
+# --- 缓存与内存预算 ---
+# 所有 LRUCache 共用一个按字节计的预算 (表面像素的估算值)，超出时从占用最多的缓存里淘汰最久没用的条目，
+# 跑上几天缓存也不会无限增长。--cache-budget 调整上限
+CACHE_BUDGET_MB = 64
+
+def entry_bytes(entry, seen=None):
+    """
+    条目 (表面，或装着表面的元组/列表/字典) 里所有表面的字节数；seen 用来跳过重复的表面
+    子表面 (图集切片) 和图集共用像素，不计
+    """
+    if isinstance(entry, pygame.Surface):
+        if seen is not None:
+            if id(entry) in seen: return 0
+            seen.add(id(entry))
+        return 0 if entry.get_parent() is not None else surface_bytes(entry)
+    if isinstance(entry, dict):
+        entry = list(entry.values())
+    if isinstance(entry, (tuple, list)):
+        return sum(entry_bytes(item, seen) for item in entry)
+    return 0
+
+class CacheBudget:
+    """LRUCache 建立时登记到这里；放入条目后 enforce() 把总字节数压回 limit 以内"""
+    def __init__(self, limit_mb=CACHE_BUDGET_MB):
+        self.caches = weakref.WeakSet()   # 渲染器等释放后它们的缓存自动退出统计
+        self.set_limit(limit_mb)
+        self.peak = 0
+        self.evictions = 0
+        self.warned = set()   # 已经警告过单个条目超预算的缓存名
+
+    def set_limit(self, limit_mb):
+        self.limit = int(limit_mb * 1024 * 1024)
+
+    def register(self, cache):
+        self.caches.add(cache)
+
+    def total(self):
+        return sum(cache.bytes for cache in list(self.caches))
+
+    def enforce(self, cache, size):
+        """
+        cache 刚放入一个 size 字节的条目。只淘汰真占字节的条目 (图集切片不占，淘汰了也省不下内存)，
+        每个缓存最近用过的那个条目不淘汰 (当前的底图、光照贴图还被拿着，淘汰了也不会释放)；
+        淘汰不动了就停下，这时总数可能仍超出预算
+        """
+        if size > self.limit and cache.name not in self.warned:
+            self.warned.add(cache.name)
+            print("hugbb: a %r cache entry is %.1f MB, larger than the whole cache budget (%.1f MB)"
+                  % (cache.name, size / 1048576.0, self.limit / 1048576.0), file=sys.stderr, flush=True)
+        total = self.total()
+        while total > self.limit:
+            victims = [(c.evictable_bytes(), c) for c in list(self.caches)]
+            spare, victim = max(victims, key=lambda item: item[0], default=(0, None))
+            if not spare:
+                break
+            total -= victim.evict(next(key for key in victim.entries if victim.sizes[key] > 0))
+            self.evictions += 1
+        self.peak = max(self.peak, total)
+
+cache_budget = CacheBudget()
+
+class LRUCache:
+    """
+    通用的有上限 LRU：get(key, build) 未命中时调用 build() 生成条目
+    条目数不超过 max_entries，同时计入全局的 cache_budget；name 是统计里的名字
+    sizeof: 条目的字节数 (条目引用了别的缓存的表面时只算自己的那部分)
+    """
+    def __init__(self, max_entries, name=None, sizeof=entry_bytes, budget=None):
+        self.max_entries = max_entries
+        self.name = name
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.budget = budget or cache_budget
+        self.budget.register(self)
+
+    def get(self, key, build):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = build()
+        self.put(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        """直接放入一个条目 (例如从图集加载的精灵)"""
+        if key in self.entries:
+            self.bytes -= self.sizes.pop(key)
+            del self.entries[key]
+        self.entries[key] = entry
+        self.sizes[key] = size = self.sizeof(entry)
+        self.bytes += size
+        while len(self.entries) > self.max_entries:
+            self.evict()
+        self.budget.enforce(self, size)
+
+    def evict(self, key=None):
+        """淘汰 key (默认最久没用的条目)，返回省下的字节数"""
+        if key is None:
+            key = next(iter(self.entries))
+        del self.entries[key]
+        size = self.sizes.pop(key)
+        self.bytes -= size
+        self.evictions += 1
+        return size
+
+    def evictable_bytes(self):
+        """除了最近用过的那个条目，其余条目的字节数"""
+        if not self.entries:
+            return 0
+        return self.bytes - self.sizes[next(reversed(self.entries))]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {"entries": len(self.entries), "max_entries": self.max_entries, "bytes": self.bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+# --- 字体与文字缓存 ---
+# SysFont 在 Linux 上要走字体查找，非常慢；每种 (字体, 字号, 粗体) 只解析一次
+BUTTON_FONT = ("arial", 20, True, 24)   # (family, size, bold, 找不到系统字体时的默认字号)
+KISS_FONT = ("arial", 24, True, 30)
+
+fonts = {}
+
+def load_font(family, size, bold=False, fallback_size=None):
+    if not pygame.font.get_init(): pygame.font.init()
+    try: return pygame.font.SysFont(family, size, bold=bold)
+    except: return pygame.font.Font(None, fallback_size or size)
+
+def get_font(family, size, bold=False, fallback_size=None):
+    key = (family, size, bold, fallback_size)
+    font = fonts.get(key)
+    if font is None:
+        font = fonts[key] = app.measure("font", load_font, *key)
+    return font
+
+class TextCache(LRUCache):
+    """渲染好的文字表面，LRU 缓存，键为 (font, text, color)"""
+    def __init__(self, max_entries=128):
+        super().__init__(max_entries, "text")
+
+    def render(self, font_spec, text, color):
+        return self.get((font_spec, text, color),
+                        lambda: track_surface(get_font(*font_spec).render(text, True, color)))
+
+text_cache = TextCache()
+
+def render_text(text, color, font_spec=BUTTON_FONT):
+    return text_cache.render(font_spec, text, color)
+
+BUTTON_STATES = ("normal", "hover", "pressed")
+BUTTON_FILLS = {"normal": BUTTON_COLOR, "hover": BUTTON_HOVER_COLOR, "pressed": BUTTON_PRESSED_COLOR}
+
+def render_button(size, text_surf, state):
+    """按钮连同阴影画成一张精灵，左上角对齐按钮矩形；按下时按钮面往阴影方向压下 2 像素"""
+    rect = pygame.Rect((0, 0), size)
+    surf = new_surface((size[0] + 3, size[1] + 3), pygame.SRCALPHA)
+    # 直接画在窗口上时阴影的 alpha 不起作用，这里也画成不透明的，保持原来的样子
+    pygame.draw.rect(surf, SHADOW_COLOR[:3], rect.move(3,3), border_radius=10)
+    if state == "pressed": rect.move_ip(2, 2)
+    pygame.draw.rect(surf, BUTTON_FILLS[state], rect, border_radius=10)
+    pygame.draw.rect(surf, (255,255,255), rect, 2, border_radius=10)
+    surf.blit(text_surf, text_surf.get_rect(center=rect.center))
+    return to_display_format(surf, alpha=True)
+
+button_sprites = LRUCache(max_entries=48, name="buttons")   # (尺寸, 文字, 状态) -> 按钮精灵
+
 class Button:
     def __init__(self, x, y, width, height, text, action_code):
         self.rect = pygame.Rect(x, y, width, height)
         self.text = text
         self.action_code = action_code
-        self.is_hovered = False
+        self.state = "normal"   # 由 ButtonBar 在鼠标事件里更新
+        self.text_surf = None
+        self.rendered_text = None
+
+    def get_text_surf(self):
+        # 只有 text 真的变了 (例如 "Hug Back" -> "Relax") 才重新取文字表面
+        if self.text != self.rendered_text:
+            self.text_surf = render_text(self.text, TEXT_COLOR, BUTTON_FONT)
+            self.rendered_text = self.text
+        return self.text_surf
+
+    def sprite(self, state):
+        key = (self.rect.size, self.text, state)
+        return button_sprites.get(key, lambda: render_button(self.rect.size, self.get_text_surf(), state))
 
     def draw(self, surface):
-        color = BUTTON_HOVER_COLOR if self.is_hovered else BUTTON_COLOR
-        pygame.draw.rect(surface, SHADOW_COLOR, self.rect.move(3,3), border_radius=10)
-        pygame.draw.rect(surface, color, self.rect, border_radius=10)
-        pygame.draw.rect(surface, (255,255,255), self.rect, 2, border_radius=10)
-        try: font = pygame.font.SysFont("arial", 20, bold=True)
-        except: font = pygame.font.Font(None, 24)
-        text_surf = font.render(self.text, True, TEXT_COLOR)
-        text_rect = text_surf.get_rect(center=self.rect.center)
-        surface.blit(text_surf, text_rect)
-
-    def check_hover(self, mouse_pos):
-        self.is_hovered = self.rect.collidepoint(mouse_pos)
-
-    def check_click(self, mouse_pos):
-        return self.rect.collidepoint(mouse_pos)
+        return surface.blit(self.sprite(self.state), self.rect.topleft)
+
+# 按钮栏：一行放不下时往上再摆一行，每行居中
+BUTTON_ACTIONS = [("Hug Back", "hug_back"), ("Fred Kiss", "boy_kiss"), ("AvA Kiss", "girl_kiss")]
+BUTTON_SIZE = (140, 45)
+BUTTON_GAP = 40
+BUTTON_BAR_Y = 620   # 稍微向上移动按钮，给狗狗腾位置
+
+class ButtonBar:
+    """
+    一组按钮。悬停/按下只在鼠标移动、按下、松开时重新计算 (hover/press/release)，
+    只改动涉及的按钮；state() 和 bounds 在两次变化之间是同一个对象，空闲帧的开销与按钮个数无关
+    """
+    def __init__(self, actions=BUTTON_ACTIONS, y=BUTTON_BAR_Y, size=BUTTON_SIZE, gap=BUTTON_GAP, width=WIDTH):
+        per_row = max(1, (width + gap) // (size[0] + gap))
+        self.buttons = []
+        for i, (text, action_code) in enumerate(actions):
+            row, col = divmod(i, per_row)
+            count = min(per_row, len(actions) - row * per_row)
+            left = (width - count * size[0] - (count - 1) * gap) // 2
+            self.buttons.append(Button(left + col * (size[0] + gap), y - row * (size[1] + gap // 2),
+                                       size[0], size[1], text, action_code))
+        self.rects = [btn.rect for btn in self.buttons]
+        self.bounds = [rect.union(rect.move(3,3)) for rect in self.rects]   # 连同阴影
+        self.hovered = None   # 按钮序号
+        self.pressed = None
+        self.key = None
+
+    def __iter__(self):
+        return iter(self.buttons)
+
+    def __len__(self):
+        return len(self.buttons)
+
+    def __getitem__(self, i):
+        return self.buttons[i]
+
+    def hit(self, pos):
+        i = pygame.Rect(pos, (1, 1)).collidelist(self.rects)
+        return None if i == -1 else i
+
+    def hover(self, pos):
+        self.update(self.hit(pos), self.pressed)
+
+    def press(self, pos):
+        """按下 pos 处的按钮并返回它 (没有则返回 None)"""
+        i = self.hit(pos)
+        self.update(i, i)
+        return None if i is None else self.buttons[i]
+
+    def release(self):
+        self.update(self.hovered, None)
+
+    def update(self, hovered, pressed):
+        touched = {self.hovered, self.pressed, hovered, pressed} - {None}
+        self.hovered, self.pressed = hovered, pressed
+        for i in touched:
+            state = "hover" if i == hovered else "normal"
+            if i == pressed: state = "pressed" if i == hovered else "normal"
+            if state != self.buttons[i].state:
+                self.buttons[i].state = state
+                self.key = None
+
+    def set_text(self, btn, text):
+        if text != btn.text:
+            btn.text = text
+            self.key = None
+
+    def state(self):
+        """状态键：每个按钮的 (文字, 状态)"""
+        if self.key is None:
+            self.key = tuple((btn.text, btn.state) for btn in self.buttons)
+        return self.key
+
+    def damage(self, prev, key):
+        """两个状态键之间变了的按钮的矩形"""
+        return [self.bounds[i] for i, (a, b) in enumerate(zip(prev, key)) if a != b]
+
+    def draw(self, surface, area=None):
+        """area 为 damage() 给出的矩形时只画这些按钮"""
+        for btn, rect in zip(self.buttons, self.bounds):
+            if area is None or rect in area:
+                btn.draw(surface)
 
 class Particle:
     def __init__(self):
@@ -96,19 +452,155 @@ class Particle:
         if self.y > HEIGHT: self.y = 0
 
     def draw(self, surface):
-        s = pygame.Surface((self.size, self.size), pygame.SRCALPHA)
+        s = new_surface((self.size, self.size), pygame.SRCALPHA)
         safe_alpha = int(max(0, min(255, self.alpha)))
         pygame.draw.circle(s, (*DUST_COLOR, safe_alpha), (self.size//2, self.size//2), self.size//2)
         surface.blit(s, (self.x, self.y))
 
+PARTICLE_COUNT = 80        # 灰尘粒子数量，弱机器上可以调低
+PARTICLE_ALPHA_STEPS = 16  # 透明度分档数，每档一张预渲染的小圆点
+
+dust_sprite_sets = {}
+
+def dust_sprites():
+    """
+    所有粒子系统共用的小圆点精灵表 (多房间时不必每个房间各画一份)
+    索引 = (size - MIN_SIZE) * PARTICLE_ALPHA_STEPS + alpha 档位
+    """
+    sprites = dust_sprite_sets.get(DUST_COLOR)
+    if sprites is None:
+        sprites = dust_sprite_sets[DUST_COLOR] = []
+        for size in range(ParticleSystem.MIN_SIZE, ParticleSystem.MAX_SIZE + 1):
+            for step in range(PARTICLE_ALPHA_STEPS):
+                alpha = ParticleSystem.MIN_ALPHA + (ParticleSystem.MAX_ALPHA - ParticleSystem.MIN_ALPHA) * step // (PARTICLE_ALPHA_STEPS - 1)
+                s = new_surface((size, size), pygame.SRCALPHA)
+                pygame.draw.circle(s, (*DUST_COLOR, alpha), (size//2, size//2), size//2)
+                sprites.append(to_display_format(s, alpha=True))
+    return sprites
+
+class ParticleSystem:
+    """
+    向量化的灰尘粒子：位置、速度、大小、透明度都存成 NumPy 数组，
+    一次性更新和回绕，再从按 (size, alpha) 分档的小圆点精灵表里批量 blits
+    行为与 Particle 一致，可以轻松跑到上万个粒子
+    """
+    MIN_SIZE, MAX_SIZE = 2, 5
+    MIN_ALPHA, MAX_ALPHA = 50, 255
+    FIELDS = ("x", "y", "size", "speed_x", "speed_y", "alpha", "fade_dir")
+
+    def __init__(self, count=PARTICLE_COUNT, width=WIDTH, height=HEIGHT, seed=None):
+        self.width, self.height = width, height
+        # 不指定种子时从 random 取，这样 random.seed() 也能让粒子可复现
+        self.rng = np.random.default_rng(random.getrandbits(32) if seed is None else seed)
+        self.sprites = dust_sprites()
+        self.x = self.y = self.speed_x = self.speed_y = None
+        self.size = self.alpha = self.fade_dir = None
+        self.spawn(count)
+
+    @property
+    def count(self):
+        return len(self.x)
+
+    def spawn(self, count):
+        rng = self.rng
+        self.x = rng.integers(0, self.width, count, endpoint=True).astype(np.float32)
+        self.y = rng.integers(0, self.height, count, endpoint=True).astype(np.float32)
+        self.size = rng.integers(self.MIN_SIZE, self.MAX_SIZE, count, endpoint=True)
+        self.speed_x = rng.uniform(0.2, 0.6, count).astype(np.float32)
+        self.speed_y = rng.uniform(-0.2, 0.2, count).astype(np.float32)
+        self.alpha = rng.integers(100, 255, count, endpoint=True).astype(np.float32)
+        self.fade_dir = np.full(count, -2, dtype=np.float32)
+
+    def update(self):
+        self.x += self.speed_x
+        self.y += self.speed_y
+        self.alpha += self.fade_dir
+        top = self.alpha >= self.MAX_ALPHA
+        bottom = self.alpha <= self.MIN_ALPHA
+        self.alpha[top] = self.MAX_ALPHA
+        self.fade_dir[top] = -2
+        self.alpha[bottom] = self.MIN_ALPHA
+        self.fade_dir[bottom] = 2
+        self.x[self.x > self.width] = 0
+        self.y[self.y < 0] = self.height
+        self.y[self.y > self.height] = 0
+
+    def resize(self, count):
+        """改变粒子数：多的截掉，不够的补上新生成的"""
+        if count <= self.count:
+            for name in self.FIELDS:
+                setattr(self, name, getattr(self, name)[:count])
+            return
+        kept = [getattr(self, name) for name in self.FIELDS]
+        self.spawn(count - self.count)
+        for name, old in zip(self.FIELDS, kept):
+            setattr(self, name, np.concatenate((old, getattr(self, name))))
+
+    def draw(self, surface):
+        steps = PARTICLE_ALPHA_STEPS - 1
+        alpha_step = ((self.alpha - self.MIN_ALPHA) * steps / (self.MAX_ALPHA - self.MIN_ALPHA) + 0.5).astype(np.intp)
+        index = (self.size - self.MIN_SIZE) * PARTICLE_ALPHA_STEPS + np.clip(alpha_step, 0, steps)
+        sprites = self.sprites
+        positions = zip(self.x.astype(np.intp).tolist(), self.y.astype(np.intp).tolist())
+        surface.blits([(sprites[i], pos) for i, pos in zip(index.tolist(), positions)], doreturn=False)
+
+    def rects(self, limit):
+        """每个粒子占据的矩形；数量超过 limit 时返回 None (交给全屏刷新)"""
+        if self.count > limit:
+            return None
+        return [pygame.Rect(x, y, size, size) for x, y, size in
+                zip(self.x.astype(np.intp).tolist(), self.y.astype(np.intp).tolist(), self.size.tolist())]
+
+class ParticleGroup:
+    """没有 numpy 时的退路：一组普通的 Particle 对象，接口与 ParticleSystem 相同"""
+    def __init__(self, count=PARTICLE_COUNT):
+        self.particles = [Particle() for _ in range(count)]
+
+    @property
+    def count(self):
+        return len(self.particles)
+
+    def update(self):
+        for p in self.particles: p.update()
+
+    def resize(self, count):
+        del self.particles[count:]
+        self.particles.extend(Particle() for _ in range(count - self.count))
+
+    def draw(self, surface):
+        for p in self.particles: p.draw(surface)
+
+    def rects(self, limit):
+        if self.count > limit:
+            return None
+        return [pygame.Rect(int(p.x), int(p.y), p.size, p.size) for p in self.particles]
+
+def create_particles(count=PARTICLE_COUNT):
+    return ParticleSystem(count) if np is not None else ParticleGroup(count)
+
 # --- 4. 绘图函数 (保持 V2 几何画风) ---
 
 def draw_room_bg(surface):
-    pygame.draw.rect(surface, BG_WALL_COLOR, (0, 0, WIDTH, 250))
-    pygame.draw.rect(surface, FLOOR_COLOR, (0, 250, WIDTH, HEIGHT-250))
-    for i in range(0, WIDTH, 150):
-        pygame.draw.line(surface, FLOOR_LINE_COLOR, (i, 250), (i, HEIGHT), 2)
-    pygame.draw.line(surface, (90, 80, 75), (0, 250), (WIDTH, 250), 4)
+    width, height = surface.get_size()
+    pygame.draw.rect(surface, BG_WALL_COLOR, (0, 0, width, 250))
+    pygame.draw.rect(surface, FLOOR_COLOR, (0, 250, width, height-250))
+    for i in range(0, width, 150):
+        pygame.draw.line(surface, FLOOR_LINE_COLOR, (i, 250), (i, height), 2)
+    pygame.draw.line(surface, (90, 80, 75), (0, 250), (width, 250), 4)
+
+def draw_bed(surface, pillows):
+    """床架、床单和枕头；pillows 为每个枕头的 (x, y) 中心上沿"""
+    bed_rect = pygame.Rect(100, 100, 600, 450)
+    pygame.draw.rect(surface, BED_FRAME_COLOR, bed_rect.inflate(10, 10), border_radius=20)
+    pygame.draw.rect(surface, SHEET_COLOR, bed_rect, border_radius=20)
+    for px, py in pillows:
+        pygame.draw.rect(surface, PILLOW_COLOR, (px - 60, py - 80, 120, 80), border_radius=15)
+
+def draw_blanket(surface):
+    blanket_rect = pygame.Rect(100, 300, 600, 250)
+    pygame.draw.rect(surface, BLANKET_SHADOW, blanket_rect.move(0, 5), border_radius=20)
+    pygame.draw.rect(surface, BLANKET_COLOR, blanket_rect, border_radius=20)
+    pygame.draw.line(surface, (220, 130, 110), (120, 350), (680, 350), 3)
 
 # --- 新增：绘制植物和宠物 ---
 # --- 新增的辅助配色 (为了更精美的细节) ---
@@ -117,67 +609,99 @@ PLANT_VEIN = (40, 70, 40)         # 深色叶脉
 POT_RIM = (170, 100, 70)          # 花盆沿口色
 POT_SHADOW = (130, 70, 50)        # 花盆阴影色
 
-def draw_fiddle_leaf_fig(surface, x, y):
-    """绘制精美、有细节和层次感的琴叶榕 (左下角)"""
+def leaf_palette():
+    return (PLANT_LEAF, PLANT_LEAF_LIGHT, PLANT_VEIN)
 
-    # --- 内部核心：绘制精美叶片的函数 ---
-    def draw_exquisite_leaf(surf, connect_x, connect_y, scale, angle):
-        """
-        绘制一片有形状、光影和叶脉的精美叶子
-        scale: 缩放比例 (1.0 为标准大小约 80x60)
-        angle: 旋转角度
-        """
-        base_w, base_h = 80 * scale, 100 * scale
-        surf_w, surf_h = int(base_w + 20), int(base_h + 20)
-        leaf_surf = pygame.Surface((surf_w, surf_h), pygame.SRCALPHA)
-        cx, cy = surf_w // 2, surf_h // 2
-
-        # 1. 叶片主体造型 (模拟小提琴形状：基部窄，端部宽)
-        # 通过叠加两个椭圆实现
-        # 端部大椭圆
-        tip_rect = pygame.Rect(cx - base_w*0.45, cy - base_h*0.4, base_w*0.9, base_h*0.6)
-        # 基部小椭圆
-        base_rect = pygame.Rect(cx - base_w*0.3, cy + base_h*0.1, base_w*0.6, base_h*0.3)
-        
-        # 绘制深色底座 (描边效果)
-        pygame.draw.ellipse(leaf_surf, PLANT_VEIN, tip_rect.inflate(4,4))
-        pygame.draw.ellipse(leaf_surf, PLANT_VEIN, base_rect.inflate(4,4))
-        
-        # 绘制主体深绿
-        pygame.draw.ellipse(leaf_surf, PLANT_LEAF, tip_rect)
-        pygame.draw.ellipse(leaf_surf, PLANT_LEAF, base_rect)
-        
-        # 2. 绘制亮部高光 (向左上方偏移，制造立体感)
-        highlight_offset_x = -base_w * 0.05
-        highlight_offset_y = -base_h * 0.05
-        pygame.draw.ellipse(leaf_surf, PLANT_LEAF_LIGHT, tip_rect.move(highlight_offset_x, highlight_offset_y).inflate(-10, -10))
-        
-        # 3. 绘制叶脉细节
-        # 主脉
-        vein_start = (cx, cy + base_h*0.35)
-        vein_end = (cx, cy - base_h*0.3)
-        pygame.draw.line(leaf_surf, PLANT_VEIN, vein_start, vein_end, 3)
-        # 侧脉 (简单的几条肋线)
-        for i in range(3):
-            pos_y = cy - base_h*0.2 + i * base_h*0.15
-            # 左侧脉
-            pygame.draw.line(leaf_surf, PLANT_VEIN, (cx, pos_y), (cx - base_w*0.3, pos_y - 5), 2)
-            # 右侧脉
-            pygame.draw.line(leaf_surf, PLANT_VEIN, (cx, pos_y), (cx + base_w*0.3, pos_y - 5), 2)
-
-        # 4. 旋转与定位
-        rotated_surf = pygame.transform.rotate(leaf_surf, angle)
+def render_exquisite_leaf(scale, palette, detail=True):
+    """
+    绘制一片有形状、光影和叶脉的精美叶子 (未旋转)
+    scale: 缩放比例 (1.0 为标准大小约 80x60)
+    palette: (叶色, 亮部叶色, 叶脉色)
+    detail: False 时只画叶片轮廓，不画高光和叶脉
+    返回 (叶片表面, base_h)
+    """
+    leaf_color, leaf_light, vein_color = palette
+    base_w, base_h = 80 * scale, 100 * scale
+    surf_w, surf_h = int(base_w + 20), int(base_h + 20)
+    leaf_surf = new_surface((surf_w, surf_h), pygame.SRCALPHA)
+    cx, cy = surf_w // 2, surf_h // 2
+
+    # 1. 叶片主体造型 (模拟小提琴形状：基部窄，端部宽)
+    # 通过叠加两个椭圆实现
+    # 端部大椭圆
+    tip_rect = pygame.Rect(cx - base_w*0.45, cy - base_h*0.4, base_w*0.9, base_h*0.6)
+    # 基部小椭圆
+    base_rect = pygame.Rect(cx - base_w*0.3, cy + base_h*0.1, base_w*0.6, base_h*0.3)
+
+    # 绘制深色底座 (描边效果)
+    pygame.draw.ellipse(leaf_surf, vein_color, tip_rect.inflate(4,4))
+    pygame.draw.ellipse(leaf_surf, vein_color, base_rect.inflate(4,4))
+
+    # 绘制主体深绿
+    pygame.draw.ellipse(leaf_surf, leaf_color, tip_rect)
+    pygame.draw.ellipse(leaf_surf, leaf_color, base_rect)
+    if not detail:
+        return leaf_surf, base_h
+
+    # 2. 绘制亮部高光 (向左上方偏移，制造立体感)
+    highlight_offset_x = -base_w * 0.05
+    highlight_offset_y = -base_h * 0.05
+    pygame.draw.ellipse(leaf_surf, leaf_light, tip_rect.move(highlight_offset_x, highlight_offset_y).inflate(-10, -10))
+
+    # 3. 绘制叶脉细节
+    # 主脉
+    vein_start = (cx, cy + base_h*0.35)
+    vein_end = (cx, cy - base_h*0.3)
+    pygame.draw.line(leaf_surf, vein_color, vein_start, vein_end, 3)
+    # 侧脉 (简单的几条肋线)
+    for i in range(3):
+        pos_y = cy - base_h*0.2 + i * base_h*0.15
+        # 左侧脉
+        pygame.draw.line(leaf_surf, vein_color, (cx, pos_y), (cx - base_w*0.3, pos_y - 5), 2)
+        # 右侧脉
+        pygame.draw.line(leaf_surf, vein_color, (cx, pos_y), (cx + base_w*0.3, pos_y - 5), 2)
+    return leaf_surf, base_h
+
+def quantize_angle(angle, step=5):
+    """把摆动角度量化到固定档位，让风吹摇摆只占用有限的缓存项"""
+    return round(angle / step) * step
+
+class LeafSpriteCache(LRUCache):
+    """
+    旋转后叶片的精灵缓存，键为 (scale, angle, palette, 细节档位)
+    每个条目保存旋转后的表面和叶柄锚点偏移，LRU 上限 max_entries
+    其他植物/摇摆动画可以共用同一个实例
+    """
+    def __init__(self, max_entries=64):
+        super().__init__(max_entries, "leaves")
+
+    def sprite(self, scale, angle, palette=None):
+        """返回 (旋转后的表面, 中心相对叶柄连接点的偏移)"""
+        key = (scale, angle, palette or leaf_palette(), quality_settings["leaf_detail"])
+        return self.get(key, lambda: self.render(*key))
+
+    def render(self, scale, angle, palette, detail):
+        leaf_surf, base_h = render_exquisite_leaf(scale, palette, detail)
+        rotated_surf = to_display_format(track_surface(pygame.transform.rotate(leaf_surf, angle)), alpha=True)
         # 计算旋转后的中心点，使其叶柄对齐连接点
         # 这里做一个简化的近似对齐
         offset_x = -math.sin(math.radians(angle)) * (base_h * 0.3)
         offset_y = math.cos(math.radians(angle)) * (base_h * 0.3)
-        
+        return (rotated_surf, (offset_x, offset_y))
+
+    def draw(self, surf, connect_x, connect_y, scale, angle, palette=None):
+        """在连接点 (connect_x, connect_y) 画一片叶子和小叶柄"""
+        rotated_surf, (offset_x, offset_y) = self.sprite(scale, angle, palette)
         draw_rect = rotated_surf.get_rect(center=(connect_x + offset_x, connect_y + offset_y))
         surf.blit(rotated_surf, draw_rect)
-        
+
         # 画个小叶柄连接一下
         pygame.draw.line(surf, PLANT_STEM, (connect_x, connect_y), (connect_x + offset_x*0.5, connect_y + offset_y*0.5), 4)
 
+leaf_sprites = LeafSpriteCache()
+
+def draw_fiddle_leaf_fig(surface, x, y, leaf_cache=None):
+    """绘制精美、有细节和层次感的琴叶榕 (左下角)"""
 
     # --- 1. 精美花盆 (带沿口和阴影) ---
     pot_y_base = y + 60
@@ -196,14 +720,21 @@ def draw_fiddle_leaf_fig(surface, x, y):
     pygame.draw.polygon(surface, PLANT_STEM, [(x-4, y+5), (x+4, y+5), (x+3, y-120), (x-3, y-120)])
     # 主干中上部
     pygame.draw.polygon(surface, PLANT_STEM, [(x-3, y-120), (x+3, y-120), (x+2, y-200), (x-2, y-200)])
-    
+
+    # 绘制所有叶片 (旋转后的叶片来自精灵缓存)
+    leaf_cache = leaf_cache or leaf_sprites
+    for lx, ly, scale, ang in fiddle_leaf_layout(x, y):
+        leaf_cache.draw(surface, lx, ly, scale, ang)
+
+def fiddle_leaf_layout(x, y):
+    """叶片的 (连接点 x, 连接点 y, 缩放, 角度)，画植物和预热叶片精灵共用"""
     # 分枝连接点
     branch_y_1 = y - 90
     branch_y_2 = y - 140
 
     # --- 3. 精美叶片布局 (位置, 缩放, 角度) ---
     # 角度：正值逆时针(向左倒), 负值顺时针(向右倒)
-    leaves_layout = [
+    return [
         # 底层大叶
         (x-20, branch_y_1+20, 1.1, 70),   # 左下大
         (x+20, branch_y_1+10, 1.1, -65),  # 右下大
@@ -216,24 +747,17 @@ def draw_fiddle_leaf_fig(surface, x, y):
         (x+10, y-210, 0.7, -30),          # 顶尖
     ]
 
-    # 绘制所有叶片
-    for lx, ly, scale, ang in leaves_layout:
-        draw_exquisite_leaf(surface, lx, ly, scale, ang)
-
 # 绘制一只有清晰头/耳/尾巴、会呼吸睡觉的橘猫
-def draw_sleeping_cat(surface, x, y):
+def render_sleeping_cat():
     """
     绘制 "液体猫猫"：严格按照照片形体，像一碗金黄的面团/牛角包
     特点：头埋在左边，背部在右边拱起，整体呈完美的圆形填满空间。
+    返回未缩放的画布，呼吸缩放由 BreathCycle 负责
     """
-    # --- 1. 呼吸动画 (沉睡的起伏) ---
-    # 频率慢，幅度小，模拟深呼吸
-    breath_scale = 1.0 + math.sin(pygame.time.get_ticks() * 0.0025) * 0.015
-    
-    # --- 2. 创建画布 ---
+    # --- 1. 创建画布 ---
     # 照片里的猫是非常圆润的一团，不需要太宽
     canvas_w, canvas_h = 120, 110
-    cat_surf = pygame.Surface((canvas_w, canvas_h), pygame.SRCALPHA)
+    cat_surf = new_surface((canvas_w, canvas_h), pygame.SRCALPHA)
     cx, cy = canvas_w // 2, canvas_h // 2
 
     # --- 配色准备 (模拟照片里的阳光感) ---
@@ -246,7 +770,7 @@ def draw_sleeping_cat(surface, x, y):
     # 阴影色 (身体蜷缩的深处)
     c_deep = (max(0, c_base[0]-30), max(0, c_base[1]-30), max(0, c_base[2]-30))
 
-    # --- 3. 绘制 "液体" 形体 (从下往上堆叠) ---
+    # --- 2. 绘制 "液体" 形体 (从下往上堆叠) ---
 
     # A. 基础填充 (那个完美的圆形底座)
     # 就像面团填满了圆形的猫抓板
@@ -288,29 +812,18 @@ def draw_sleeping_cat(surface, x, y):
     # 稍微切一下底部的圆弧，让它看起来有重力感
     # 这一步通过不画正圆，而是略微压扁的椭圆(base_rect)已经实现了
 
-    # --- 4. 呼吸与输出 ---
-    target_w = int(canvas_w * breath_scale)
-    target_h = int(canvas_h * breath_scale)
-    scaled_cat = pygame.transform.smoothscale(cat_surf, (target_w, target_h))
-    
-    # 修正位置：因为形状变圆了，可能需要微调一下显示的中心
-    surface.blit(scaled_cat, (x - target_w//2, y - target_h//2))
+    return cat_surf
 
 DOG_COLOR = (245, 240, 235) # 米白底色
-def draw_sleeping_dog(surface, x, y, color_base=DOG_COLOR):
+def render_sleeping_dog(color_base=DOG_COLOR):
     """
-    绘制一只毛绒绒、会呼吸睡觉的拉布拉多
-    x, y: 狗狗的中心位置
+    绘制一只毛绒绒、睡觉的拉布拉多 (未缩放的画布)
     color_base: 狗狗的基础色 (例如 DOG_COLOR)
     """
-    # 1. 计算呼吸缩放比例 (速度慢一点，幅度小一点，看起来睡得很沉)
-    # 利用时间生成一个在 1.0 到 1.03 之间波动的系数
-    breath_scale = 1.0 + math.sin(pygame.time.get_ticks() * 0.003) * 0.015
-    
-    # 2. 创建临时画布 (足够大能放下整个狗)
+    # 1. 创建临时画布 (足够大能放下整个狗)
     # 使用 SRCALPHA 确保背景透明
     canvas_w, canvas_h = 160, 130
-    dog_surf = pygame.Surface((canvas_w, canvas_h), pygame.SRCALPHA)
+    dog_surf = new_surface((canvas_w, canvas_h), pygame.SRCALPHA)
     # 临时画布的中心坐标，用于相对绘图
     cx, cy = canvas_w // 2, canvas_h // 2
     
@@ -364,14 +877,100 @@ def draw_sleeping_dog(surface, x, y, color_base=DOG_COLOR):
     # 鼻子 (深棕色小圆点)
     pygame.draw.circle(dog_surf, (60, 50, 40), (cx-58, cy+15), 5)
 
-    # --- 3. 应用呼吸缩放 ---
-    target_w = int(canvas_w * breath_scale)
-    target_h = int(canvas_h * breath_scale)
-    # 使用 smoothscale 进行平滑缩放，抗锯齿
-    scaled_dog = pygame.transform.smoothscale(dog_surf, (target_w, target_h))
-    
-    # 4. 绘制到主屏幕 (修正中心点，确保缩放时位置不变)
-    surface.blit(scaled_dog, (x - target_w//2, y - target_h//2))
+    return dog_surf
+
+# --- 呼吸动画：预烘焙的循环帧 ---
+# 呼吸只是 ±1.5% 的缩放，把一个周期采样成 BREATH_FRAMES 帧后按时间索引播放，
+# 每帧只剩一次 blit。帧数越多越平滑，但占用内存越多 (缩放后尺寸相同的帧会共享表面)
+BREATH_FRAMES = 32
+
+class BreathCycle:
+    """
+    一个呼吸周期的预缩放帧
+    render: 返回未缩放画布的函数
+    speed: 正弦角速度 (弧度/毫秒)，amplitude: 缩放幅度
+    """
+    def __init__(self, render, speed, amplitude=0.015, frame_count=None):
+        self.render = render
+        self.speed = speed
+        self.amplitude = amplitude
+        self.frame_count = frame_count or BREATH_FRAMES
+        self.base = None
+        self.frames = None
+
+    def scale_at(self, phase):
+        return 1.0 + math.sin(phase) * self.amplitude
+
+    def build(self):
+        for _ in self.build_steps(): pass
+        return self
+
+    def build_steps(self):
+        """分步烘焙的生成器：画底图、每缩放出一种尺寸各算一步 (见 WarmupTasks)"""
+        if self.frames is not None:
+            return
+        base = self.render()
+        yield
+        canvas_w, canvas_h = base.get_size()
+        by_size = {}
+        frames = []
+        for i in range(self.frame_count):
+            breath_scale = self.scale_at(2 * math.pi * i / self.frame_count)
+            size = (int(canvas_w * breath_scale), int(canvas_h * breath_scale))
+            if size not in by_size:
+                by_size[size] = scale_surface(base, size)
+                yield
+            frames.append(by_size[size])
+        self.base = base
+        self.frames = frames
+
+    def frame_at(self, ticks):
+        frames = self.frames
+        if frames is None:
+            frames = self.build().frames
+        phase = (ticks * self.speed) % (2 * math.pi)
+        return frames[int(phase / (2 * math.pi) * len(frames)) % len(frames)]
+
+    def draw(self, surface, x, y, ticks=None):
+        if ticks is None:
+            ticks = time.perf_counter() * 1000.0   # 不依赖 pygame 的计时子系统 (没有调用 pygame.init)
+        frame = self.frame_at(ticks)
+        # 修正中心点，确保缩放时位置不变
+        return surface.blit(frame, (x - frame.get_width()//2, y - frame.get_height()//2))
+
+breath_cycles = {}
+
+def get_breath_cycle(key, render, speed):
+    key = (key, quality_settings["smooth"])   # 两种缩放方式烘焙出的帧不同
+    cycle = breath_cycles.get(key)
+    if cycle is None:
+        cycle = breath_cycles[key] = BreathCycle(render, speed)
+    return cycle
+
+def cat_breath_cycle():
+    # 频率慢，幅度小，模拟深呼吸
+    return get_breath_cycle(("cat", CAT_COLOR, CAT_STRIPE), render_sleeping_cat, 0.0025)
+
+def dog_breath_cycle(color_base=DOG_COLOR):
+    # 速度慢一点，幅度小一点，看起来睡得很沉
+    return get_breath_cycle(("dog", color_base), lambda: render_sleeping_dog(color_base), 0.003)
+
+def prebake_breath_cycles():
+    """提前烘焙猫狗的呼吸帧 (主循环里改为分帧预热，见 warm_breath)"""
+    for cycle in (cat_breath_cycle(), dog_breath_cycle()):
+        if cycle.frames is None: cycle.build()
+
+def draw_sleeping_cat(surface, x, y, ticks=None):
+    """绘制会呼吸睡觉的橘猫，x, y 为中心位置"""
+    return cat_breath_cycle().draw(surface, x, y, ticks)
+
+def draw_sleeping_dog(surface, x, y, color_base=DOG_COLOR, ticks=None):
+    """
+    绘制一只毛绒绒、会呼吸睡觉的拉布拉多
+    x, y: 狗狗的中心位置
+    color_base: 狗狗的基础色 (例如 DOG_COLOR)
+    """
+    return dog_breath_cycle(color_base).draw(surface, x, y, ticks)
 
 # --------------------------------
 
@@ -412,153 +1011,2475 @@ def draw_face(surface, x, y, is_boy, kiss_offset=(0,0)):
     pygame.draw.ellipse(surface, BLUSH_COLOR, (x + 15, y + 10, 10, 6))
     if kiss_offset != (0,0): pygame.draw.circle(surface, (200, 100, 100), (x, y + 20), 5) 
 
-def draw_heart(surface, x, y, scale, alpha=255):
-    temp_surf = pygame.Surface((100, 100), pygame.SRCALPHA)
-    width = 40 * scale
-    height = 40 * scale
+# --- 爱心：按 (几何尺寸, 透明度档位) 缓存的精灵 ---
+HEART_ALPHA_STEPS = 16    # 透明度分档数
+heart_sprites = LRUCache(max_entries=256, name="hearts")
+
+def heart_geometry(scale):
+    """爱心的整数几何 (半宽, 圆半径, 尖角高度)；scale 相近时取整后相同，共用一张精灵"""
+    width = height = 40 * scale
+    return int(width//2), int(width//4), int(height//1.5)
+
+def quantize_alpha(alpha, steps=HEART_ALPHA_STEPS):
+    safe_alpha = max(0, min(255, alpha))
+    return int(safe_alpha * (steps - 1) / 255 + 0.5) * 255 // (steps - 1)
+
+def render_heart(geometry, alpha):
+    """返回 (精灵, 相对爱心中心的偏移)，精灵已裁掉透明边"""
+    half_w, radius, tip = geometry
+    temp_surf = new_surface((100, 100), pygame.SRCALPHA)
     center_x, center_y = 50, 50
-    triangle_pts = [(center_x - width//2, center_y), (center_x + width//2, center_y), (center_x, center_y + height//1.5)]
-    safe_alpha = int(max(0, min(255, alpha)))
-    color = (*HEART_COLOR, safe_alpha)
-    pygame.draw.circle(temp_surf, color, (center_x - width//4, center_y - height//4), width//4)
-    pygame.draw.circle(temp_surf, color, (center_x + width//4, center_y - height//4), width//4)
+    triangle_pts = [(center_x - half_w, center_y), (center_x + half_w, center_y), (center_x, center_y + tip)]
+    color = (*HEART_COLOR, alpha)
+    pygame.draw.circle(temp_surf, color, (center_x - radius, center_y - radius), radius)
+    pygame.draw.circle(temp_surf, color, (center_x + radius, center_y - radius), radius)
     pygame.draw.polygon(temp_surf, color, triangle_pts)
-    surface.blit(temp_surf, (x - 50, y - 50))
+    content = temp_surf.get_bounding_rect()
+    sprite = to_display_format(temp_surf.subsurface(content), alpha=True)
+    return sprite, (content.x - center_x, content.y - center_y)
 
-# --- 5. 主程序 ---
+def heart_sprite_specs():
+    """爱心粒子会用到的 (尺寸, 透明度) 档位：小爱心 (亲亲喷出的) 每个透明度档都有，大的只有不透明的"""
+    for width in range(8, 41):
+        for alpha in range(HEART_ALPHA_STEPS) if width <= 20 else [HEART_ALPHA_STEPS - 1]:
+            yield width / 40.0, alpha * 255 // (HEART_ALPHA_STEPS - 1)
 
-def main():
-    girl_x, girl_y = 300, 250
-    boy_start_x, boy_y = 550, 250
-    boy_x = boy_start_x
-    
-    progress = 0.0
-    animation_speed = 0.01
-    initial_anim_done = False
-    
-    girl_is_hugging_back = False
-    kiss_action = None 
-    kiss_timer = 0
-    
-    # 稍微向上移动按钮，给狗狗腾位置
-    buttons = [
-        Button(150, 620, 140, 45, "Hug Back", "hug_back"),
-        Button(330, 620, 140, 45, "Fred Kiss", "boy_kiss"),
-        Button(510, 620, 140, 45, "AvA Kiss", "girl_kiss")
-    ]
+def heart_sprite(scale, alpha=255):
+    geometry, alpha = heart_geometry(scale), quantize_alpha(alpha)
+    return heart_sprites.get((geometry, alpha), lambda: render_heart(geometry, alpha))
 
-    particles = [Particle() for _ in range(80)]
+def draw_heart(surface, x, y, scale, alpha=255):
+    sprite, (ox, oy) = heart_sprite(scale, alpha)
+    return surface.blit(sprite, (int(x) + ox, int(y) + oy))
 
-    running = True
-    while running:
-        mouse_pos = pygame.mouse.get_pos()
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: running = False
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if initial_anim_done:
-                    for btn in buttons:
-                        if btn.check_click(mouse_pos):
-                            if btn.action_code == "hug_back":
-                                girl_is_hugging_back = not girl_is_hugging_back
-                                btn.text = "Relax" if girl_is_hugging_back else "Hug Back"
-                            elif btn.action_code == "boy_kiss":
-                                kiss_action, kiss_timer = "boy", 60
-                            elif btn.action_code == "girl_kiss":
-                                kiss_action, kiss_timer = "girl", 60
-
-        if progress < 1.0:
-            progress += animation_speed
-            move_progress = 1 - math.pow(1 - progress, 3) 
-            boy_x = boy_start_x - (boy_start_x - (girl_x + 60)) * move_progress
-            roll_height = math.sin(progress * math.pi) * 30 
-            current_boy_y = boy_y - roll_height
+def heart_rect(x, y):
+    """draw_heart 会触及的区域"""
+    return pygame.Rect(x - 50, y - 50, 100, 100)
+
+# --- 亲亲时飘出的爱心 ---
+HEART_BURST_CAPACITY = 64  # 同时存在的爱心上限，槽位在创建时一次分配好
+KISS_HEART_COUNT = 24      # 每次亲亲喷出的爱心数
+
+class HeartBurst:
+    """
+    固定容量的爱心粒子池：所有状态存在预先分配的列表里，空闲槽位用栈管理，
+    emit() 只改写槽位，不创建对象也不分配表面；精灵来自 heart_sprites
+    """
+    def __init__(self, capacity=HEART_BURST_CAPACITY, seed=None):
+        self.capacity = capacity
+        self.rng = random.Random(random.getrandbits(32) if seed is None else seed)
+        self.x = [0.0] * capacity
+        self.y = [0.0] * capacity
+        self.speed_x = [0.0] * capacity
+        self.speed_y = [0.0] * capacity
+        self.scale = [0.0] * capacity
+        self.life = [0] * capacity
+        self.max_life = [1] * capacity
+        self.free = list(range(capacity - 1, -1, -1))
+        self.active = []
+        self.steps = 0     # 有爱心时每步加一，用作图层状态
+
+    @property
+    def count(self):
+        return len(self.active)
+
+    def emit(self, count, x, y):
+        """从 (x, y) 喷出 count 个爱心，池满时多出的直接丢弃"""
+        rng = self.rng
+        for _ in range(min(count, len(self.free))):
+            i = self.free.pop()
+            self.x[i], self.y[i] = x + rng.uniform(-10, 10), y + rng.uniform(-5, 5)
+            self.speed_x[i] = rng.uniform(-2.5, 2.5)
+            self.speed_y[i] = rng.uniform(-3.0, -1.0)
+            self.scale[i] = rng.uniform(0.25, 0.5)
+            self.life[i] = self.max_life[i] = rng.randint(50, 90)
+            self.active.append(i)
+
+    def update(self):
+        if not self.active:
+            return
+        self.steps += 1
+        expired = False
+        for i in self.active:
+            self.x[i] += self.speed_x[i]
+            self.y[i] += self.speed_y[i]
+            self.speed_x[i] *= 0.97
+            self.speed_y[i] = self.speed_y[i] * 0.98 - 0.01   # 越飘越慢
+            self.life[i] -= 1
+            if self.life[i] <= 0: expired = True
+        if expired:
+            self.free.extend(i for i in self.active if self.life[i] <= 0)
+            self.active[:] = [i for i in self.active if self.life[i] > 0]
+
+    def sprites(self):
+        for i in self.active:
+            alpha = 255 * self.life[i] / self.max_life[i]
+            sprite, (ox, oy) = heart_sprite(self.scale[i], alpha)
+            yield sprite, (int(self.x[i]) + ox, int(self.y[i]) + oy)
+
+    def draw(self, surface):
+        surface.blits(list(self.sprites()), doreturn=False)
+
+    def rects(self, limit):
+        if self.count > limit:
+            return None
+        return [sprite.get_rect(topleft=pos) for sprite, pos in self.sprites()]
+
+    def state(self):
+        return self.steps if self.active else None
+
+    def clear(self):
+        self.free.extend(self.active)
+        self.active.clear()
+
+# --- 5. 静态图层缓存 ---
+# 房间、床、被子和植物在启动后不再变化，预先合成一次，每帧只需 blit
+
+def scene_palette():
+    """静态图层用到的全部配色，任何一项变化都会触发重建"""
+    return (BG_WALL_COLOR, FLOOR_COLOR, FLOOR_LINE_COLOR,
+            BED_FRAME_COLOR, SHEET_COLOR, PILLOW_COLOR, BLANKET_COLOR, BLANKET_SHADOW,
+            POT_COLOR, POT_RIM, POT_SHADOW, PLANT_STEM, PLANT_LEAF, PLANT_LEAF_LIGHT, PLANT_VEIN)
+
+def crop_to_content(surf):
+    """裁掉透明边缘，返回 (子图, 左上角坐标)"""
+    bounds = surf.get_bounding_rect()
+    return track_surface(surf.subsurface(bounds).copy()), bounds.topleft
+
+class StaticLayers:
+    """
+    静态图层：
+    back    - 人物下方 (房间 + 床 + 枕头)，不透明
+    blanket - 人物上方的被子
+    plant   - 猫咪上方的琴叶榕
+    窗口尺寸、配色或叶片细节变化时自动重建
+    """
+    def __init__(self, pillows, plant_pos=(100, 680)):
+        self.pillows = pillows
+        self.plant_pos = plant_pos
+        self.key = None
+        self.layers = {}
+
+    def ensure(self, target):
+        """需要时重建，返回是否发生了重建"""
+        key = (target.get_size(), scene_palette(), quality_settings["leaf_detail"])
+        if key != self.key:
+            self.rebuild(target.get_size())
+            self.key = key
+            return True
+        return False
+
+    def rebuild(self, size):
+        self.rebuild_back(size)
+
+        blanket = new_surface(size, pygame.SRCALPHA)
+        draw_blanket(blanket)
+        surf, pos = crop_to_content(blanket)
+        self.layers["blanket"] = (to_display_format(surf, alpha=True), pos)
+
+        plant = new_surface(size, pygame.SRCALPHA)
+        draw_fiddle_leaf_fig(plant, *self.plant_pos)
+        surf, pos = crop_to_content(plant)
+        self.layers["plant"] = (to_display_format(surf, alpha=True), pos)
+
+    def rebuild_back(self, size):
+        back = new_surface(size)
+        draw_room_bg(back)
+        draw_bed(back, self.pillows)
+        self.layers["back"] = (to_display_format(back, alpha=False), (0, 0))
+
+    def blit(self, target, name, area=None):
+        """area 不为空时只恢复该矩形内的部分 (脏矩形模式)"""
+        surf, pos = self.layers[name]
+        if area is None:
+            return target.blit(surf, pos)
+        clipped = surf.get_rect(topleft=pos).clip(area)
+        if clipped.w and clipped.h:
+            target.blit(surf, clipped.topleft, clipped.move(-pos[0], -pos[1]))
+        return clipped
+
+static_layer_sets = {}
+
+def get_static_layers(pillows, plant_pos=(100, 680)):
+    """布局相同的房间共用一套静态图层"""
+    key = (tuple(pillows), plant_pos)
+    layers = static_layer_sets.get(key)
+    if layers is None:
+        layers = static_layer_sets[key] = StaticLayers(list(pillows), plant_pos)
+    return layers
+
+# --- 6. 场景状态与图层 ---
+# 模拟以固定步长推进 (SIM_HZ 次/秒)，与渲染帧率无关：掉帧时动画不会变慢，
+# 高刷新率屏幕上也不会变快；渲染时在前后两个模拟状态之间插值
+SIM_HZ = 60
+SIM_STEP_MS = 1000.0 / SIM_HZ
+MAX_SIM_STEPS = 5      # 每个渲染帧最多补几步模拟，再多就丢弃积压的时间 (慢动作而不是卡死)
+MAX_FRAME_SKIP = 2     # 落后时最多连续跳过几次渲染，先把模拟追上
+RENDER_FPS = 60        # 渲染帧率上限，0 表示不限
+
+class Room:
+    """
+    一个房间的布局与配色 (纯数据，坐标都是房间内的局部坐标)；
+    Scene 按它摆放人物、宠物和植物，布局相同的房间共用静态图层和精灵
+    """
+    def __init__(self, girl_pos=(300, 250), boy_pos=(550, 250), cat_pos=(200, 450), dog_pos=(680, 680),
+                 plant_pos=(100, 680), dog_color=DOG_COLOR):
+        self.girl_pos = girl_pos
+        self.boy_pos = boy_pos     # 男孩翻滚开始的位置
+        self.cat_pos = cat_pos
+        self.dog_pos = dog_pos
+        self.plant_pos = plant_pos
+        self.dog_color = dog_color
+
+class Scene:
+    """一个房间的全部动态状态；update() 推进一个固定步长 (SIM_STEP_MS) 的模拟"""
+    def __init__(self, lighting=None, room=None):
+        self.room = room = room or Room()
+        self.girl_x, self.girl_y = room.girl_pos
+        self.boy_start_x, self.boy_y = room.boy_pos
+        self.boy_x = self.boy_start_x
+        self.current_boy_y = self.boy_y
+
+        self.progress = 0.0
+        self.animation_speed = 0.01
+        self.initial_anim_done = False
+
+        self.girl_is_hugging_back = False
+        self.kiss_action = None
+        self.kiss_timer = 0
+        self.boy_offset, self.girl_offset = (0,0), (0,0)
+
+        self.ticks = 0.0       # 模拟时间 (毫秒)
+        self.previous = None   # 上一步的插值字段，见 view()
+        self.pointer = (0, 0)  # 见 mouse_pos
+
+        self.buttons = ButtonBar(BUTTON_ACTIONS)
+        self.particles = create_particles(PARTICLE_COUNT)
+        self.hearts = HeartBurst()
+        self.static_layers = get_static_layers([(self.girl_x, self.girl_y), (self.boy_start_x, self.boy_y)],
+                                               room.plant_pos)
+        self.lighting = lighting or default_lighting
+
+    @property
+    def particle_count(self):
+        return self.particles.count
+
+    def set_quality(self, preset):
+        self.particles.resize(preset.particles)
+        self.lighting.enabled = preset.lighting
+
+    @property
+    def mouse_pos(self):
+        return self.pointer
+
+    @mouse_pos.setter
+    def mouse_pos(self, pos):
+        """鼠标移动时才重新判断悬停"""
+        self.pointer = pos
+        if self.initial_anim_done:
+            self.buttons.hover(pos)
+
+    def click(self, mouse_pos):
+        if not self.initial_anim_done:
+            return
+        btn = self.buttons.press(mouse_pos)
+        if btn is None:
+            return
+        if btn.action_code == "hug_back":
+            self.girl_is_hugging_back = not self.girl_is_hugging_back
+            self.buttons.set_text(btn, "Relax" if self.girl_is_hugging_back else "Hug Back")
+        elif btn.action_code == "boy_kiss":
+            self.kiss_action, self.kiss_timer = "boy", 60
+            self.hearts.emit(KISS_HEART_COUNT, *kiss_label_pos(self))
+        elif btn.action_code == "girl_kiss":
+            self.kiss_action, self.kiss_timer = "girl", 60
+            self.hearts.emit(KISS_HEART_COUNT, *kiss_label_pos(self))
+
+    def release(self):
+        self.buttons.release()
+
+    def tap(self, pos):
+        """脚本用：移到 pos，按下并马上松开"""
+        self.mouse_pos = pos
+        self.click(pos)
+        self.release()
+
+    INTERPOLATED = ("boy_x", "current_boy_y", "progress", "kiss_timer", "ticks")
+
+    def roll_pose(self, progress):
+        """开场翻滚时男孩的位置，只取决于 progress"""
+        move_progress = 1 - math.pow(1 - progress, 3)
+        boy_x = self.boy_start_x - (self.boy_start_x - (self.girl_x + 60)) * move_progress
+        roll_height = math.sin(progress * math.pi) * 30
+        return boy_x, self.boy_y - roll_height
+
+    def update(self):
+        self.previous = {name: getattr(self, name) for name in self.INTERPOLATED}
+        self.ticks += SIM_STEP_MS
+        if self.progress < 1.0:
+            self.progress += self.animation_speed
+            self.boy_x, self.current_boy_y = self.roll_pose(self.progress)
         else:
-            progress = 1.0
-            initial_anim_done = True
-            boy_x = girl_x + 60
-            current_boy_y = boy_y
-
-        boy_offset, girl_offset = (0,0), (0,0)
-        if kiss_timer > 0:
-            kiss_timer -= 1
-            if kiss_action == "boy": boy_offset = (-15, 5)
-            elif kiss_action == "girl": girl_offset = (15, 0)
+            if not self.initial_anim_done:
+                intro_roll(self.animation_speed).release()
+                self.buttons.hover(self.pointer)   # 按钮出现在没动的鼠标下面
+            self.progress = 1.0
+            self.initial_anim_done = True
+            self.boy_x = self.girl_x + 60
+            self.current_boy_y = self.boy_y
+
+        self.boy_offset, self.girl_offset = (0,0), (0,0)
+        if self.kiss_timer > 0:
+            self.kiss_timer -= 1
+            if self.kiss_action == "boy": self.boy_offset = (-15, 5)
+            elif self.kiss_action == "girl": self.girl_offset = (15, 0)
         else:
-            kiss_action = None
+            self.kiss_action = None
+
+        self.particles.update()
+        self.hearts.update()
+
+    def view(self, alpha):
+        """渲染用的视图：alpha 为距下一步模拟的比例 (0~1)，在上一步和当前步之间插值"""
+        return SceneView(self, alpha) if self.previous is not None and alpha > 0 else self
+
+class SceneView:
+    """只读的插值视图，未插值的属性直接转给 Scene"""
+    def __init__(self, scene, alpha):
+        self.scene = scene
+        prev = scene.previous
+        for name in Scene.INTERPOLATED:
+            a, b = prev[name], getattr(scene, name)
+            setattr(self, name, a + (b - a) * alpha)
+        # 亲亲刚开始/刚结束的那一步是跳变，不插值
+        if prev["kiss_timer"] <= 0 or scene.kiss_timer <= 0:
+            self.kiss_timer = scene.kiss_timer
+
+    def __getattr__(self, name):
+        return getattr(self.scene, name)
+
+class FixedTimestep:
+    """累加器式的固定步长：advance() 返回本帧要跑几步模拟，alpha 是插值比例"""
+    def __init__(self, hz=SIM_HZ, max_steps=MAX_SIM_STEPS, max_skip=MAX_FRAME_SKIP):
+        self.step_ms = 1000.0 / hz
+        self.max_steps = max_steps
+        self.max_skip = max_skip
+        self.accumulator = 0.0
+        self.skipped = 0
+        self.behind = False
+
+    def advance(self, elapsed_ms):
+        self.accumulator += elapsed_ms
+        steps = min(int(self.accumulator // self.step_ms), self.max_steps)
+        self.accumulator -= steps * self.step_ms
+        self.behind = self.accumulator >= self.step_ms
+        return steps
+
+    def should_render(self):
+        """跟不上时跳过渲染 (最多连续 max_skip 帧)，仍跟不上就丢弃积压的时间"""
+        if self.behind and self.skipped < self.max_skip:
+            self.skipped += 1
+            return False
+        if self.behind:
+            self.accumulator %= self.step_ms
+        self.skipped = 0
+        return True
+
+    @property
+    def alpha(self):
+        return min(1.0, self.accumulator / self.step_ms)
+
+# 每个图层: draw(surface, scene) 负责绘制；动态图层还提供
+# bounds(scene) -> 本帧会触及的矩形列表 (None 表示整屏) 和 state(scene) -> 外观状态键，
+# 状态键和矩形都没变的图层在脏矩形模式下不算脏
+
+# --- 人物精灵缓存 ---
+# 人物只在点按钮时换姿势，把每种姿势画成一张精灵，空闲时每个人物只需一次 blit；
+# 开场翻滚时身体宽度和翻滚高度只取决于 progress，按模拟步预先生成整个序列
+CHAR_ANCHOR = (65, 60)    # 人物坐标 (x, y) 在精灵里的位置：左右各留 65 (头发 + 亲亲偏移)，上方 60
+CHAR_SIZE = (130, 190)
+
+character_sprites = LRUCache(max_entries=32, name="characters")
+
+def character_canvas(extra_left=0, frac=(0.0, 0.0)):
+    """
+    新建人物精灵画布，返回 (画布, 人物在画布里的坐标)
+    frac: 人物坐标的小数部分，保留下来使取整结果和直接画在屏幕上完全一致
+    """
+    ax, ay = CHAR_ANCHOR[0] + extra_left, CHAR_ANCHOR[1]
+    surf = new_surface((CHAR_SIZE[0] + extra_left, CHAR_SIZE[1]), pygame.SRCALPHA)
+    return surf, (ax, ay), (ax + frac[0], ay + frac[1])
+
+def render_girl_sprite(kiss_offset):
+    surf, anchor, (x, y) = character_canvas()
+    draw_pill_shape(surf, GIRL_CLOTHES, pygame.Rect(x - 30, y, 60, 120))
+    draw_face(surf, x, y, is_boy=False, kiss_offset=kiss_offset)
+    return to_display_format(surf, alpha=True), anchor
+
+def render_boy_sprite(kiss_offset, arm_dx, arm_dy):
+    """抱住之后的男孩：身体、伸向女孩的手臂 (arm_dx, arm_dy 为手臂相对男孩坐标的终点) 和脸"""
+    surf, anchor, (x, y) = character_canvas(extra_left=max(0, -arm_dx))
+    draw_pill_shape(surf, BOY_CLOTHES, pygame.Rect(x - 30, y, 60, 120))
+    pygame.draw.line(surf, BOY_CLOTHES, (x, y + arm_dy), (x + arm_dx, y + arm_dy), 20)
+    draw_face(surf, x, y, is_boy=True, kiss_offset=kiss_offset)
+    return to_display_format(surf, alpha=True), anchor
+
+def render_roll_sprite(progress, frac):
+    """开场翻滚中的男孩 (身体随 progress 变窄)"""
+    surf, anchor, (x, y) = character_canvas(frac=frac)
+    body_width = roll_body_width(progress)
+    draw_pill_shape(surf, BOY_CLOTHES, pygame.Rect(x - body_width/2, y, body_width, 120))
+    draw_face(surf, x, y, is_boy=True)
+    return to_display_format(surf, alpha=True), anchor
+
+def render_hug_arm_sprite(hand_dx, hand_dy):
+    """女孩回抱的手臂，锚点是女孩坐标，手在 (hand_dx, hand_dy)"""
+    surf, anchor, (x, y) = character_canvas()
+    pygame.draw.line(surf, GIRL_CLOTHES, (x, y + 45), (x + hand_dx, y + hand_dy + 45), 18)
+    pygame.draw.circle(surf, SKIN_COLOR, (x + hand_dx, y + hand_dy + 45), 10)
+    return to_display_format(surf, alpha=True), anchor
+
+class IntroRoll:
+    """开场翻滚的预计算序列：第 i 项对应第 i 步模拟后的 progress，按需生成"""
+    def __init__(self, speed):
+        self.speed = speed
+        self.frames = {}
+        # 和 Scene.update 用完全相同的累加方式得到每一步的 progress
+        self.steps = [0.0]
+        while self.steps[-1] < 1.0:
+            self.steps.append(self.steps[-1] + speed)
+
+    def frame(self, scene, progress):
+        index = min(len(self.steps) - 1, int(round(progress / self.speed)))
+        entry = self.frames.get(index)
+        if entry is None:
+            step_progress = self.steps[index]
+            boy_x, boy_y = scene.roll_pose(step_progress)
+            frac = (boy_x - math.floor(boy_x), boy_y - math.floor(boy_y))
+            entry = self.frames[index] = render_roll_sprite(step_progress, frac)
+        return entry
+
+    def prebake(self, scene):
+        for step_progress in self.steps:
+            if step_progress < 1.0: self.frame(scene, step_progress)
+
+    def release(self):
+        """翻滚结束后不会再用到，释放内存"""
+        self.frames.clear()
+
+intro_rolls = {}
+
+def intro_roll(speed):
+    roll = intro_rolls.get(speed)
+    if roll is None:
+        roll = intro_rolls[speed] = IntroRoll(speed)
+    return roll
+
+def blit_sprite(surface, sprite, x, y):
+    surf, (ax, ay) = sprite
+    return surface.blit(surf, (math.floor(x) - ax, math.floor(y) - ay))
+
+def roll_body_width(progress):
+    return 60 - abs(math.sin(progress * math.pi)) * 20
+
+def draw_characters(surface, scene):
+    girl_x, girl_y, boy_x, boy_y = scene.girl_x, scene.girl_y, scene.boy_x, scene.boy_y
+    girl_offset, boy_offset = scene.girl_offset, scene.boy_offset
+    blit_sprite(surface, character_sprites.get(("girl", girl_offset), lambda: render_girl_sprite(girl_offset)),
+                girl_x, girl_y)
+
+    if scene.progress < 1.0:
+        blit_sprite(surface, intro_roll(scene.animation_speed).frame(scene, scene.progress), boy_x, scene.current_boy_y)
+    else:
+        arm_dx, arm_dy = int(girl_x - boy_x), int(boy_y + 40 - scene.current_boy_y)
+        blit_sprite(surface, character_sprites.get(("boy", boy_offset, arm_dx, arm_dy),
+                                                   lambda: render_boy_sprite(boy_offset, arm_dx, arm_dy)),
+                    boy_x, scene.current_boy_y)
+        if scene.girl_is_hugging_back:
+            hand_dx, hand_dy = int(boy_x - 10 - girl_x), int(boy_y - girl_y)
+            blit_sprite(surface, character_sprites.get(("hug_arm", hand_dx, hand_dy),
+                                                       lambda: render_hug_arm_sprite(hand_dx, hand_dy)),
+                        girl_x, girl_y)
+
+def character_bounds(scene):
+    # 头发/脸最宽约 ±50，身体到 y + 120，再留一点余量
+    girl = pygame.Rect(scene.girl_x + scene.girl_offset[0] - 55, scene.girl_y + scene.girl_offset[1] - 55, 110, 180)
+    boy = pygame.Rect(scene.boy_x + scene.boy_offset[0] - 55, scene.current_boy_y + scene.boy_offset[1] - 55, 110, 180)
+    return [girl.union(boy)]
+
+def character_state(scene):
+    return (scene.boy_x, scene.current_boy_y, scene.progress, scene.boy_offset, scene.girl_offset,
+            scene.girl_is_hugging_back)
+
+def draw_dog_layer(surface, scene):
+    draw_sleeping_dog(surface, *scene.room.dog_pos, scene.room.dog_color, ticks=scene.ticks)   # 右下角的狗
+
+def draw_cat_layer(surface, scene):
+    draw_sleeping_cat(surface, *scene.room.cat_pos, ticks=scene.ticks)   # 床左下角的猫 (会呼吸)
+
+def pet_layer(cycle, pos):
+    """猫狗图层的 bounds/state：呼吸帧表面本身就是状态键；cycle(scene)、pos(scene) 取该房间的宠物"""
+    def bounds(scene):
+        frame = cycle(scene).frame_at(scene.ticks)
+        x, y = pos(scene)
+        return [frame.get_rect(topleft=(x - frame.get_width()//2, y - frame.get_height()//2))]
+    def state(scene):
+        return cycle(scene).frame_at(scene.ticks)
+    return bounds, state
+
+def kiss_label_pos(scene):
+    mid_x = (scene.girl_x + scene.boy_x) // 2
+    mid_y = (scene.girl_y + scene.boy_y) // 2 - 20
+    return mid_x, mid_y
+
+def draw_kiss_effect(surface, scene):
+    if scene.kiss_timer > 0:
+        mid_x, mid_y = kiss_label_pos(scene)
+        scale = 1.0 + math.sin(scene.kiss_timer * 0.2) * 0.2
+        draw_heart(surface, mid_x, mid_y - 30, scale * 0.8)
+        txt = render_text("Muah!", HEART_COLOR, KISS_FONT)
+        surface.blit(txt, (mid_x - 20, mid_y - 80 - (60-scene.kiss_timer)))
+
+def kiss_effect_bounds(scene):
+    if scene.kiss_timer <= 0:
+        return []
+    mid_x, mid_y = kiss_label_pos(scene)
+    txt = render_text("Muah!", HEART_COLOR, KISS_FONT)
+    return [heart_rect(mid_x, mid_y - 30), txt.get_rect(topleft=(mid_x - 20, mid_y - 80 - (60-scene.kiss_timer)))]
+
+def draw_buttons(surface, scene, area=None):
+    if scene.initial_anim_done:
+        scene.buttons.draw(surface, area)
+
+def button_bounds(scene):
+    return scene.buttons.bounds if scene.initial_anim_done else []
+
+def button_state(scene):
+    return scene.initial_anim_done and scene.buttons.state()
+
+def button_damage(scene, prev, key):
+    return prev and key and scene.buttons.damage(prev, key)
+
+def idle_heart_pos(scene):
+    if scene.initial_anim_done and scene.kiss_timer == 0:
+        heart_scale = 0.6 + math.sin(scene.ticks * 0.003) * 0.05
+        return (scene.girl_x + scene.boy_x) // 2, scene.girl_y - 50, heart_scale
+    return None
+
+def draw_idle_heart(surface, scene):
+    pos = idle_heart_pos(scene)
+    if pos: draw_heart(surface, *pos)
+
+def idle_heart_bounds(scene):
+    pos = idle_heart_pos(scene)
+    return [heart_rect(pos[0], pos[1])] if pos else []
+
+def idle_heart_state(scene):
+    """脉动很慢，只有取整后的几何变了才需要重画"""
+    pos = idle_heart_pos(scene)
+    return pos and (pos[0], pos[1], heart_geometry(pos[2]))
+
+def static_layer(name):
+    def draw(surface, scene, area=None):
+        return scene.static_layers.blit(surface, name, area)
+    return draw
+
+def draw_light_layer(surface, scene, area=None):
+    scene.lighting.apply(surface, area)
+
+class Layer:
+    """
+    场景图的一个节点，渲染器按 z 从小到大画
+    group: 性能统计时归入的类别 (background, pets, characters, ...)
+    light: 光照图层，它下方的图层都会被打光
+    cache: 大于 0 时按 (状态键, 外包矩形) 缓存画好的整个节点 (最多这么多份)，状态不变时只要一次 blit。
+           只适合内部元素互不重叠的节点：不重叠的精灵先贴到透明底上再贴上屏幕，和直接贴逐像素一致
+    damage: 节点由互不重叠的几块 (bounds 里的每个矩形) 组成时给出：damage(scene, 上一帧状态键, 本帧状态键)
+            返回变了的那几块，返回空则整个节点重画。脏矩形模式下只重画变了的和被别的图层碰到的那几块，
+            draw 要接受 area 参数 (要画的矩形列表)
+    visible: False 时渲染器跳过这个节点
+    dirty: invalidate() 置位，下一帧不管状态键变没变都重画 (静态节点则重新预合成底图)
+    """
+    def __init__(self, name, draw, bounds=None, state=None, static=False, group=None, light=False, z=0, cache=0,
+                 damage=None):
+        self.name = name
+        self.draw = draw
+        self.bounds = bounds
+        self.state = state
+        self.static = static or light
+        self.group = group or name
+        self.light = light
+        self.z = z
+        self.damage = damage
+        self.visible = True
+        self.dirty = False
+        self.cache = LRUCache(cache, "node:" + name) if cache else None
+
+    def invalidate(self):
+        self.dirty = True
+
+def scene_layers():
+    """严格图层顺序 (z 之间留了空，插入新节点不用改别的)"""
+    dog_bounds, dog_state = pet_layer(lambda scene: dog_breath_cycle(scene.room.dog_color), lambda scene: scene.room.dog_pos)
+    cat_bounds, cat_state = pet_layer(lambda scene: cat_breath_cycle(), lambda scene: scene.room.cat_pos)
+    return [
+        # Layer 1 + 3: 背景与床主体 (预合成的静态图层，床也在这一张里)
+        Layer("back", static_layer("back"), static=True, group="background", z=0),
+        # Layer 2: 环境物件 (宠物) - 狗在床外侧，与床不重叠，可以放在静态图层之后
+        Layer("dog", draw_dog_layer, dog_bounds, dog_state, group="pets", z=10),
+        # Layer 4: 人物
+        Layer("characters", draw_characters, character_bounds, character_state, z=20),
+        # Layer 5: 被子；猫咪放在被子上，营造温馨感，同时呼吸动画让场景更生动
+        Layer("blanket", static_layer("blanket"), static=True, z=30),
+        Layer("cat", draw_cat_layer, cat_bounds, cat_state, group="pets", z=40),
+        Layer("plant", static_layer("plant"), static=True, group="background", z=50),   # 左下角植物
+        # Layer 6: 氛围层 (光照与粒子 - 最上层，盖住所有物体)
+        Layer("light", draw_light_layer, light=True, group="lighting", z=60),
+        Layer("particles", lambda surface, scene: scene.particles.draw(surface),
+              lambda scene: scene.particles.rects(MAX_DIRTY_RECTS), z=70),
+        # Layer 7: UI与特效
+        Layer("kiss", draw_kiss_effect, kiss_effect_bounds, lambda scene: (scene.kiss_timer, scene.boy_x), group="ui",
+              z=80),
+        Layer("hearts", lambda surface, scene: scene.hearts.draw(surface),
+              lambda scene: scene.hearts.rects(MAX_DIRTY_RECTS), lambda scene: scene.hearts.state(), group="ui", z=90),
+        Layer("buttons", draw_buttons, button_bounds, button_state, group="ui", z=100, cache=8, damage=button_damage),
+        Layer("heart", draw_idle_heart, idle_heart_bounds, idle_heart_state, group="ui", z=110),
+    ]
 
-        # --- 绘图 (严格图层顺序) ---
-        
-        # Layer 1: 背景
-        draw_room_bg(screen) 
-        
-        # Layer 2: 环境物件 (植物、宠物) - 在床之前绘制
-        draw_sleeping_dog(screen, 680, 680)   # 右下角的狗
-
-        # Layer 3: 床主体
-        bed_rect = pygame.Rect(100, 100, 600, 450)
-        pygame.draw.rect(screen, BED_FRAME_COLOR, bed_rect.inflate(10, 10), border_radius=20)
-        pygame.draw.rect(screen, SHEET_COLOR, bed_rect, border_radius=20)
-        pygame.draw.rect(screen, PILLOW_COLOR, (girl_x - 60, girl_y - 80, 120, 80), border_radius=15)
-        pygame.draw.rect(screen, PILLOW_COLOR, (boy_start_x - 60, boy_y - 80, 120, 80), border_radius=15)
+# --- 7. 光照 ---
+# 光照贴图按 (窗口尺寸, 光源配置, 时段) 烘焙一次并缓存；光照是线性的 alpha 混合，
+# 所以静态图层可以连同光照一起预合成，只有光照下方的动态图层所在的小块区域需要每帧打光
+TIME_OF_DAY = False       # 打开后按本地时间给光照叠加时段色调
+TIME_OF_DAY_STEPS = 24    # 一天分成几个色调档位 (每档烘焙一张光照贴图)
+TIME_OF_DAY_KEYFRAMES = [ # (小时, 色调 RGBA)，档位之间线性插值
+    (0, (30, 40, 90, 70)),      # 深夜偏蓝
+    (6, (255, 190, 140, 30)),   # 清晨
+    (12, (255, 255, 255, 0)),   # 正午不加色调
+    (18, (255, 150, 80, 40)),   # 黄昏
+    (21, (40, 50, 100, 60)),    # 入夜
+]
+
+# 光源: key() 返回可哈希的配置 (用作贴图缓存键)，draw(surface) 画在透明层上
+class WindowLight:
+    """窗外照进来的暖光 (原来的整屏斜光)"""
+    def __init__(self, color=None):
+        self.color = color
+
+    def key(self):
+        return ("window", self.color or LIGHT_COLOR)
 
-        # Layer 4: 人物
-        draw_pill_shape(screen, GIRL_CLOTHES, pygame.Rect(girl_x - 30, girl_y, 60, 120))
-        draw_face(screen, girl_x, girl_y, is_boy=False, kiss_offset=girl_offset)
+    def draw(self, surface):
+        width, height = surface.get_size()
+        pygame.draw.polygon(surface, self.color or LIGHT_COLOR, [(0,0), (width, 0), (width, 500), (0, height)])
+
+class LampLight:
+    """床头灯：一圈一圈变淡的圆形光晕"""
+    def __init__(self, pos, radius=160, color=(255, 210, 150, 60), rings=8):
+        self.pos, self.radius, self.color, self.rings = pos, radius, color, rings
+
+    def key(self):
+        return ("lamp", self.pos, self.radius, self.color, self.rings)
 
-        if progress < 1.0:
-            body_width = 60 - abs(math.sin(progress * math.pi)) * 20
-            draw_pill_shape(screen, BOY_CLOTHES, pygame.Rect(boy_x - body_width/2, current_boy_y, body_width, 120))
-            draw_face(screen, boy_x, current_boy_y, is_boy=True)
+    def draw(self, surface):
+        r, g, b, a = self.color
+        for i in range(self.rings):
+            # 从外到内，每圈覆盖上一圈，越往里越亮
+            ring_alpha = a * (i + 1) // self.rings
+            pygame.draw.circle(surface, (r, g, b, ring_alpha), self.pos, self.radius * (self.rings - i) // self.rings)
+
+def time_of_day_tint(hour):
+    """hour (0~24) 对应的色调，在关键帧之间插值"""
+    frames = TIME_OF_DAY_KEYFRAMES + [(TIME_OF_DAY_KEYFRAMES[0][0] + 24, TIME_OF_DAY_KEYFRAMES[0][1])]
+    for (h0, c0), (h1, c1) in zip(frames, frames[1:]):
+        if h0 <= hour < h1:
+            t = (hour - h0) / float(h1 - h0)
+            return tuple(int(round(x0 + (x1 - x0) * t)) for x0, x1 in zip(c0, c1))
+    return TIME_OF_DAY_KEYFRAMES[0][1]
+
+def local_hour():
+    now = time.localtime()
+    return now.tm_hour + now.tm_min / 60.0
+
+class LightingEngine:
+    """
+    管理光源和烘焙好的光照贴图
+    lights: 光源列表 (WindowLight, LampLight...)
+    time_of_day: 打开后按 clock() 的小时数选一个时段档位，档位变化时才换贴图
+    """
+    def __init__(self, lights=None, time_of_day=TIME_OF_DAY, steps=TIME_OF_DAY_STEPS,
+                 clock=local_hour, max_cached=4):
+        self.lights = lights if lights is not None else [WindowLight()]
+        self.time_of_day = time_of_day
+        self.steps = steps
+        self.clock = clock
+        self.enabled = True
+        self.cache = LRUCache(max_cached, "lightmaps")   # key -> (贴图, 左上角)
+        self.key = None
+        self.lightmap = None
+
+    def set_lights(self, lights):
+        self.lights = list(lights)
+
+    def current_key(self, size):
+        if not self.enabled:
+            return (size, None)
+        bucket = None
+        if self.time_of_day:
+            bucket = int(self.clock() % 24 / 24.0 * self.steps) % self.steps
+        return (size, tuple(light.key() for light in self.lights), bucket)
+
+    def ensure(self, size):
+        """选出当前配置的贴图 (需要时烘焙)，返回当前的配置键"""
+        key = self.current_key(size)
+        if key != self.key:
+            self.lightmap = self.cache.get(key, lambda: self.bake(key))
+            self.key = key
+        return key
+
+    def bake(self, key):
+        size, lights, bucket = key if len(key) == 3 else (key[0], None, None)
+        if lights is None:
+            return None
+        lightmap = new_surface(size, pygame.SRCALPHA)
+        if bucket is not None:
+            tint = time_of_day_tint((bucket + 0.5) * 24.0 / self.steps)
+            if tint[3]: lightmap.fill(tint)
+        for light in self.lights:
+            # 每个光源先画在自己的透明层上，再叠加，这样多个光源和色调会混合而不是互相覆盖
+            layer = new_surface(size, pygame.SRCALPHA)
+            light.draw(layer)
+            lightmap.blit(layer, (0, 0))
+        surf, pos = crop_to_content(lightmap)
+        return to_display_format(surf, alpha=True), pos
+
+    def apply(self, surface, area=None):
+        """把光照混合到 surface 上；area 不为空时只处理该矩形"""
+        if self.lightmap is None:
+            return
+        surf, pos = self.lightmap
+        if area is None:
+            surface.blit(surf, pos)
+            return
+        clipped = surf.get_rect(topleft=pos).clip(area)
+        if clipped.w and clipped.h:
+            surface.blit(surf, clipped.topleft, clipped.move(-pos[0], -pos[1]))
+
+default_lighting = LightingEngine()
+
+LAMP_POS = (740, 140)   # 床头右侧
+
+def set_lamp(on, lighting=default_lighting):
+    """--lamp：在窗光之外加一盏床头灯 (光源变了，贴图和预合成底图会按新的键重新烘焙)"""
+    lights = [light for light in lighting.lights if not isinstance(light, LampLight)]
+    lighting.set_lights(lights + [LampLight(LAMP_POS)] if on else lights)
+
+def lamp_on(lighting=default_lighting):
+    return any(isinstance(light, LampLight) for light in lighting.lights)
+
+# --- 8. 渲染器 (全屏 / 脏矩形) ---
+# 每帧先铺一张预合成的静态底图 (房间、床、被子、植物，已经打好光)；
+# 光照下方的动态图层 (宠物、人物) 只在自己的矩形里恢复未打光的静态图层、按顺序重画，再单独打光；
+# 光照上方的动态图层 (粒子、UI) 直接画。
+# 脏矩形模式：每个动态图层报告本帧触及的矩形，与上一帧合并后，
+# 只在这些区域里做上面的事，再用 display.update(rects) 只推送这些区域；
+# 脏区域超过阈值时回退为整屏 flip
+DIRTY_RECTS = False           # 默认关闭，main(dirty_rects=True) 打开
+DIRTY_AREA_THRESHOLD = 0.4    # 脏区域占屏幕面积的比例上限
+MAX_DIRTY_RECTS = 256
+
+def merge_rects(rects, bounds):
+    """把重叠的矩形合并 (取外包矩形)，并裁剪到 bounds 内"""
+    merged = []
+    for r in rects:
+        r = pygame.Rect(r).clip(bounds)
+        if not (r.w and r.h):
+            continue
+        i = r.collidelist(merged)
+        while i != -1:
+            r.union_ip(merged.pop(i))
+            i = r.collidelist(merged)
+        merged.append(r)
+    return merged
+
+def subtract_rect(r, cut):
+    """r 减去 cut，返回互不重叠的剩余部分"""
+    if not r.colliderect(cut):
+        return [r]
+    pieces = []
+    if cut.top > r.top: pieces.append(pygame.Rect(r.left, r.top, r.w, cut.top - r.top))
+    if cut.bottom < r.bottom: pieces.append(pygame.Rect(r.left, cut.bottom, r.w, r.bottom - cut.bottom))
+    top, bottom = max(r.top, cut.top), min(r.bottom, cut.bottom)
+    if cut.left > r.left: pieces.append(pygame.Rect(r.left, top, cut.left - r.left, bottom - top))
+    if cut.right < r.right: pieces.append(pygame.Rect(cut.right, top, r.right - cut.right, bottom - top))
+    return pieces
+
+def disjoint_rects(rects, bounds):
+    """覆盖同样区域、但互不重叠的矩形 (不像 merge_rects 那样扩大面积)，打光时每个像素只处理一次"""
+    pieces = []
+    for r in rects:
+        r = pygame.Rect(r).clip(bounds)
+        if not (r.w and r.h):
+            continue
+        new = [r]
+        for p in pieces:
+            new = [q for n in new for q in subtract_rect(n, p)]
+        pieces.extend(new)
+    return pieces
+
+class ScaledTarget:
+    """
+    渲染缩放用的绘制目标：对图层来说尺寸和坐标还是窗口的 (逻辑坐标)，实际画进缩小了 scale 倍的缓冲；
+    贴进来的表面按 scale 缩小一次后缓存。光照下方的图层都只贴精灵，所以只需要 blit/blits
+    """
+    def __init__(self, size, scale, max_cached=256):
+        self.size = size
+        self.scale = scale
+        self.surface = to_display_format(new_surface((max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))),
+                                         alpha=False)
+        # id(源表面) -> (源表面, 缩小后的表面)；源表面属于别的缓存，只计缩小后的
+        self.sprites = LRUCache(max_cached, "scaled", sizeof=lambda entry: entry_bytes(entry[1]))
+
+    def get_size(self):
+        return self.size
+
+    def get_rect(self, **kwargs):
+        rect = pygame.Rect((0, 0), self.size)
+        for name, value in kwargs.items(): setattr(rect, name, value)
+        return rect
+
+    def scaled(self, source):
+        # 条目里留着源表面的引用，缓存里的 id 不会被别的表面复用
+        return self.sprites.get(id(source), lambda: (source, self.shrink(source)))[1]
+
+    def shrink(self, source):
+        # 每个表面只缩一次，一直用 smoothscale：最近邻缩小时取样的行列跟着贴图位置变，
+        # 底图和局部重画的同一块图案会差一个像素
+        w, h = source.get_size()
+        return track_surface(pygame.transform.smoothscale(source, (max(1, round(w * self.scale)), max(1, round(h * self.scale)))))
+
+    def blit(self, source, dest, area=None, special_flags=0):
+        s = self.scale
+        x, y = dest[0], dest[1]
+        size = source.get_size()
+        scaled_area = None
+        left, top = int(x * s), int(y * s)
+        if area is not None:
+            # 源表面整张贴上去时的位置是 (x - area.x, y - area.y)，按它来换算，和整张贴的像素对齐
+            area = pygame.Rect(area)
+            size = area.size
+            origin_x, origin_y = int((x - area.x) * s), int((y - area.y) * s)
+            scaled_area = pygame.Rect(left - origin_x, top - origin_y,
+                                      int((x + area.w) * s) - left, int((y + area.h) * s) - top)
+        self.surface.blit(self.scaled(source), (left, top), scaled_area, special_flags)
+        return pygame.Rect((x, y), size)
+
+    def blits(self, blit_sequence, doreturn=True):
+        rects = [self.blit(*item) for item in blit_sequence]
+        return rects if doreturn else None
+
+class SceneRenderer:
+    def __init__(self, layers=None, dirty_rects=DIRTY_RECTS, threshold=DIRTY_AREA_THRESHOLD):
+        self.nodes = list(layers or scene_layers())   # 场景图的全部节点；self.layers 是按 z 排好的可见节点
+        self.dirty_rects = dirty_rects
+        self.threshold = threshold
+        self.previous = {}      # 图层名 -> (上一帧矩形, 上一帧状态键)
+        self.force_full = True
+        self.composite = None   # 全部静态图层 + 光照的预合成底图
+        self.composite_key = None
+        self.composites = LRUCache(max_entries=4, name="composites")   # 多个房间布局不同时各自的底图
+        self.layer_times = None # 设为 {} 时按 layer.group 累计每个图层的耗时 (秒)
+        self.overlays = []      # 画在所有图层之上的回调 overlay(surface) -> 触及的矩形或 None
+        self.render_scale = 1.0 # 小于 1 时光照及其下方的图层画进缩小的缓冲，推送前放大一次
+        self.target = None      # render_scale 对应的 ScaledTarget
+        self.scratch = None     # 画带缓存的节点用的透明草稿表面
+        self.arrange()
+
+    def arrange(self):
+        """节点增删、改 z 或显隐之后重新排序，下一帧整屏重画"""
+        self.layers = sorted((node for node in self.nodes if node.visible), key=lambda node: node.z)
+        lights = [i for i, layer in enumerate(self.layers) if layer.light]
+        self.light_index = lights[0] if lights else len(self.layers)
+        self.dynamic = {layer.name for layer in self.layers if not layer.static}
+        self.previous.clear()
+        self.composites.clear()
+        self.composite_key = None
+        self.invalidate()
+
+    def node(self, name):
+        for node in self.nodes:
+            if node.name == name:
+                return node
+        raise KeyError(name)
+
+    def add_node(self, node):
+        self.nodes.append(node)
+        self.arrange()
+        return node
+
+    def remove_node(self, name):
+        self.nodes.remove(self.node(name))
+        self.arrange()
+
+    def set_visible(self, name, visible):
+        self.node(name).visible = visible
+        self.arrange()
+
+    def draw_layer(self, layer, surface, scene, *area):
+        if self.layer_times is None:
+            return self.draw_node(layer, surface, scene, *area)
+        start = time.perf_counter()
+        self.draw_node(layer, surface, scene, *area)
+        self.layer_times[layer.group] = self.layer_times.get(layer.group, 0.0) + time.perf_counter() - start
+
+    def draw_node(self, layer, surface, scene, *area):
+        if layer.static or area:   # 动态节点带 area 时只重画 damage 报告的部分
+            return layer.draw(surface, scene, *area)
+        if layer.cache is None:
+            layer.draw(surface, scene)
+        else:
+            if layer.dirty: layer.cache.clear()
+            rects = layer.bounds(scene)
+            if rects:
+                box = rects[0].unionall(rects[1:])
+                surf = layer.cache.get((layer.state(scene), tuple(box)),
+                                       lambda: self.render_node(layer, scene, box, surface.get_size()))
+                surface.blit(surf, box.topleft)
+        layer.dirty = False
+
+    def render_node(self, layer, scene, box, size):
+        """在透明的草稿表面上画一遍节点，拷出它的外包矩形"""
+        if self.scratch is None or self.scratch.get_size() != size:
+            self.scratch = new_surface(size, pygame.SRCALPHA)
+        box = box.clip(self.scratch.get_rect())
+        self.scratch.fill((0, 0, 0, 0), box)
+        layer.draw(self.scratch, scene)
+        return to_display_format(track_surface(self.scratch.subsurface(box).copy()), alpha=True)
+
+    def draw_overlays(self, surface):
+        rects = []
+        for overlay in self.overlays:
+            rect = overlay(surface)
+            if rect: rects.append(rect)
+        return rects
+
+    def present(self, surface, rects=None):
+        overlay_rects = self.draw_overlays(surface)
+        if rects is not None: rects = rects + overlay_rects
+        start = time.perf_counter()
+        if rects is None: pygame.display.flip()
+        else: pygame.display.update(rects)
+        if self.layer_times is not None:
+            self.layer_times["present"] = self.layer_times.get("present", 0.0) + time.perf_counter() - start
+
+    def invalidate(self):
+        """下一帧整屏重画 (例如静态图层重建、窗口尺寸变化)"""
+        self.force_full = True
+
+    def set_render_scale(self, scale):
+        if scale != self.render_scale:
+            self.render_scale = scale
+            self.target = None
+            self.invalidate()
+
+    def scaled_target(self, surface):
+        if self.target is None or self.target.size != surface.get_size():
+            self.target = ScaledTarget(surface.get_size(), self.render_scale)
+        return self.target
+
+    def upscale(self, target, window):
+        """把缩小的缓冲整张放大到窗口上 (用最近邻 scale，smoothscale 放大整屏太慢)"""
+        start = time.perf_counter()
+        pygame.transform.scale(target.surface, window.get_size(), window)
+        if self.layer_times is not None:
+            self.layer_times["upscale"] = self.layer_times.get("upscale", 0.0) + time.perf_counter() - start
+
+    def ensure_composite(self, surface, scene):
+        """静态图层或光照贴图变了 (或者有静态节点被 invalidate) 就重新预合成，返回是否重建"""
+        if any(layer.dirty for layer in self.layers if layer.static):
+            for layer in self.layers:
+                if layer.static: layer.dirty = False
+            self.composites.clear()
+            self.composite_key = None
+        static_layers = scene.static_layers
+        static_layers.ensure(surface)
+        key = (tuple(static_layers.pillows), static_layers.plant_pos, static_layers.key,
+               scene.lighting.ensure(surface.get_size()))
+        if key == self.composite_key:
+            return False
+        self.composite = self.composites.get(key, lambda: self.build_composite(surface.get_size(), scene))
+        self.composite_key = key
+        return True
+
+    def build_composite(self, size, scene):
+        composite = new_surface(size)
+        for layer in self.layers:
+            if layer.static:
+                layer.draw(composite, scene)
+        return to_display_format(composite, alpha=False)
+
+    def collect_dirty(self, scene, bounds):
+        """
+        计算所有动态图层本帧的矩形，返回 (脏矩形列表, 需要重画的图层名集合, {只重画一部分的图层名: 矩形})
+        脏矩形列表为 None 表示需要整屏刷新
+        """
+        dirty, changed, partial, full = [], set(), {}, False
+        for layer in self.layers:
+            if layer.static:
+                continue
+            rects = layer.bounds(scene)
+            key = layer.state(scene) if layer.state else None
+            prev = self.previous.get(layer.name)
+            self.previous[layer.name] = (rects, key)
+            if rects is None or prev is None or prev[0] is None:
+                full = True
+                continue
+            if key is None or key != prev[1] or rects != prev[0] or layer.dirty:
+                part = (layer.damage and key is not None and rects == prev[0] and not layer.dirty
+                        and layer.damage(scene, prev[1], key))
+                if part:
+                    dirty.extend(part)
+                    partial[layer.name] = part
+                else:
+                    dirty.extend(prev[0])
+                    dirty.extend(rects)
+                changed.add(layer.name)
+        if full or len(dirty) > MAX_DIRTY_RECTS:
+            return None, changed, {}
+        # 合并后的外包矩形会覆盖没变的图层：和脏区域相交的图层也要整体重画
+        # (裁剪后的粗线和整画的像素不完全一致)，它的矩形又可能碰到别的图层，直到不再扩大为止
+        # 有 damage 的图层由互不重叠的几块组成，只补画碰到脏区域的那几块
+        dirty = merge_rects(dirty, bounds)
+        grew = True
+        while grew:
+            grew = False
+            for layer in self.layers:
+                if layer.static or (layer.name in changed and layer.name not in partial):
+                    continue
+                rects = self.previous[layer.name][0]
+                if layer.damage:
+                    done = partial.get(layer.name, [])
+                    hit = [r for r in rects if r not in done and r.collidelist(dirty) != -1]
+                    if hit:
+                        partial[layer.name] = done + hit
+                        dirty = merge_rects(dirty + hit, bounds)
+                        changed.add(layer.name)
+                        grew = True
+                elif any(r.collidelist(dirty) != -1 for r in rects):
+                    dirty = merge_rects(dirty + rects, bounds)
+                    changed.add(layer.name)
+                    grew = True
+        return dirty, changed, partial
+
+    def draw_frame(self, surface, scene, dirty, redraw, window=None, partial=None):
+        """
+        dirty 为 None 时整屏绘制；redraw 为需要重画的动态图层名
+        window: surface 是 ScaledTarget 时的真实窗口，光照画完后整张放大上去，光照上方的图层按原分辨率全部重画
+        partial: 只重画一部分的图层名 -> 要重画的矩形 (见 collect_dirty)
+        """
+        partial = partial or {}
+        screen_rect = surface.get_rect()
+        # 1. 预合成的静态底图 (已打光)
+        if dirty is None:
+            self.timed_blit(surface, self.composite, None, "background")
         else:
-            draw_pill_shape(screen, BOY_CLOTHES, pygame.Rect(boy_x - 30, current_boy_y, 60, 120))
-            pygame.draw.line(screen, BOY_CLOTHES, (boy_x, boy_y + 40), (girl_x, boy_y + 40), 20)
-            draw_face(screen, boy_x, current_boy_y, is_boy=True, kiss_offset=boy_offset)
-            if girl_is_hugging_back:
-                 pygame.draw.line(screen, GIRL_CLOTHES, (girl_x, girl_y + 45), (boy_x - 10, boy_y + 45), 18)
-                 pygame.draw.circle(screen, SKIN_COLOR, (boy_x - 10, boy_y + 45), 10)
-
-        # Layer 5: 被子
-        blanket_rect = pygame.Rect(100, 300, 600, 250)
-        pygame.draw.rect(screen, BLANKET_SHADOW, blanket_rect.move(0, 5), border_radius=20)
-        pygame.draw.rect(screen, BLANKET_COLOR, blanket_rect, border_radius=20)
-        pygame.draw.line(screen, (220, 130, 110), (120, 350), (680, 350), 3)
-
-        # 猫咪放在被子上，营造温馨感，同时呼吸动画让场景更生动
-        draw_sleeping_cat(screen, 200, 450)   # 床左下角的猫 (会呼吸)
-        draw_fiddle_leaf_fig(screen, 100, 680) # 左下角植物
-        
+            for r in dirty:
+                self.timed_blit(surface, self.composite, r, "background")
+
+        # 2. 光照下方需要重画的动态图层：在它们的矩形里恢复未打光的静态图层，按顺序重画，再打光
+        below = self.layers[:self.light_index]
+        light = self.layers[self.light_index:self.light_index+1]
+        above = self.layers[self.light_index+1:]
+        lit = [layer for layer in below if not layer.static and layer.name in redraw]
+        region = []
+        for layer in lit:
+            rects = partial.get(layer.name) or self.previous[layer.name][0]
+            region.extend(rects if rects is not None else [screen_rect])
+        region = disjoint_rects(region, screen_rect)
+        if region:
+            for layer in below:
+                if layer.static:
+                    for r in region: self.draw_layer(layer, surface, scene, r)
+                elif layer.name in redraw:
+                    self.draw_layer(layer, surface, scene, *self.partial_area(partial, layer))
+            for layer in light:
+                for r in region: self.draw_layer(layer, surface, scene, r)
+        if window is not None:
+            # 整张放大会盖掉上一帧光照上方的内容，所以这些图层都要重画
+            self.upscale(surface, window)
+            surface, region, redraw, partial = window, [window.get_rect()], self.dynamic, {}
+        # 3. 光照上方的图层 (静态的已经在底图里，只需补上被第 2 步盖掉的部分)
+        for layer in above:
+            if layer.static:
+                for r in region: self.draw_layer(layer, surface, scene, r)
+            elif layer.name in redraw:
+                self.draw_layer(layer, surface, scene, *self.partial_area(partial, layer))
+
+    def partial_area(self, partial, layer):
+        """draw_layer 的 area 参数：只重画一部分时是 (矩形列表,)"""
+        return (partial[layer.name],) if layer.name in partial else ()
+
+    def timed_blit(self, surface, source, area, group):
+        start = time.perf_counter()
+        if area is None: surface.blit(source, (0, 0))
+        else: surface.blit(source, area.topleft, area)
+        if self.layer_times is not None:
+            self.layer_times[group] = self.layer_times.get(group, 0.0) + time.perf_counter() - start
+
+    def draw_full(self, surface, scene, window=None):
+        self.ensure_composite(surface, scene)
+        # 整屏模式只需要光照下方图层的矩形 (决定打光区域)
+        for layer in self.layers[:self.light_index]:
+            if not layer.static:
+                self.previous[layer.name] = (layer.bounds(scene), None)
+        self.draw_frame(surface, scene, None, self.dynamic, window)
+
+    def render(self, surface, scene):
+        """绘制一帧并推送到屏幕"""
+        dirty = self.draw(surface, scene)
+        self.present(surface, dirty)
+        return dirty
+
+    def draw(self, surface, scene):
+        """绘制一帧但不推送，返回脏矩形列表 (None 为整屏)"""
+        window = None
+        if self.render_scale != 1.0:
+            surface, window = self.scaled_target(surface), surface
+        if not self.dirty_rects:
+            self.draw_full(surface, scene, window)
+            return None
+        if self.ensure_composite(surface, scene):
+            self.invalidate()
+
+        screen_rect = surface.get_rect()
+        dirty, changed, partial = self.collect_dirty(scene, screen_rect)
+        if dirty is not None:
+            area = sum(r.w * r.h for r in dirty)
+            if area > screen_rect.w * screen_rect.h * self.threshold:
+                dirty = None
+        if dirty is None or self.force_full:
+            self.force_full = False
+            self.draw_frame(surface, scene, None, self.dynamic, window)
+            return None
+        self.draw_frame(surface, scene, dirty, changed, window, partial)
+        return dirty
+
+# --- 9. 画质 ---
+# 弱机器 (网页版、手机) 用的画质预设：渲染缩放、缩放算法、粒子数、光照、叶片细节
+# adaptive 模式按实测帧耗时自动升降档
+class QualityPreset:
+    def __init__(self, name, render_scale, smooth, particles, lighting, leaf_detail):
+        self.name = name
+        self.render_scale = render_scale  # 光照及其下方图层的内部渲染比例
+        self.smooth = smooth              # smoothscale 还是 scale
+        self.particles = particles        # 灰尘粒子数
+        self.lighting = lighting          # 是否打光
+        self.leaf_detail = leaf_detail    # 叶片高光和叶脉
+
+# 从低到高排列，adaptive 模式按这个顺序升降
+QUALITY_PRESETS = [
+    QualityPreset("low", 0.5, smooth=False, particles=20, lighting=False, leaf_detail=False),
+    QualityPreset("medium", 1.0, smooth=False, particles=40, lighting=True, leaf_detail=True),
+    QualityPreset("high", 1.0, smooth=True, particles=PARTICLE_COUNT, lighting=True, leaf_detail=True),
+]
+QUALITY = "high"
+QUALITY_BUDGET_MS = 12.0   # adaptive 模式的每帧耗时预算
+QUALITY_WINDOW = 60        # 每隔多少帧评估一次 (切换后的第一个窗口不算，里面有重新烘焙的开销)
+
+def quality_preset(name):
+    for preset in QUALITY_PRESETS:
+        if preset.name == name:
+            return preset
+    raise ValueError("unknown quality preset: %s" % name)
+
+class QualityController:
+    """
+    把画质预设应用到场景和渲染器；adaptive=True 时注册为 frame hook，
+    最近一个窗口的帧耗时中位数超过预算就降一档，低于预算的一半就升一档
+    render_scale: 覆盖预设里的渲染比例
+    """
+    def __init__(self, scene, renderer, preset=QUALITY, adaptive=False, budget_ms=QUALITY_BUDGET_MS,
+                 window=QUALITY_WINDOW, render_scale=None):
+        self.scene = scene
+        self.renderer = renderer
+        self.budget_ms = budget_ms
+        self.window = window
+        self.render_scale = render_scale
+        self.samples = []
+        self.skip = True
+        self.index = QUALITY_PRESETS.index(quality_preset(preset))
+        self.apply(self.index)
+        if adaptive: add_frame_hook(self)
+
+    @property
+    def preset(self):
+        return QUALITY_PRESETS[self.index]
+
+    def apply(self, index):
+        self.index = index
+        preset = self.preset
+        quality_settings["smooth"] = preset.smooth
+        quality_settings["leaf_detail"] = preset.leaf_detail
+        self.scene.set_quality(preset)
+        self.renderer.set_render_scale(self.render_scale or preset.render_scale)
+        self.renderer.invalidate()
+        self.samples.clear()
+        self.skip = True
+
+    def step(self, direction):
+        """direction: -1 降一档，+1 升一档；返回是否换了档"""
+        index = max(0, min(len(QUALITY_PRESETS) - 1, self.index + direction))
+        if index == self.index:
+            return False
+        self.apply(index)
+        return True
+
+    def __call__(self, record):
+        self.samples.append(record["frame_ms"])
+        if len(self.samples) < self.window:
+            return
+        frame_ms = sorted(self.samples)[len(self.samples) // 2]
+        self.samples.clear()
+        if self.skip:
+            self.skip = False
+        elif frame_ms > self.budget_ms:
+            self.step(-1)
+        elif frame_ms < self.budget_ms * 0.5:
+            self.step(+1)
+
+    def close(self):
+        remove_frame_hook(self)
+
+# --- 10. 多房间 ---
+# 很多个房间拼成一面墙：每个房间是一个独立的 Scene (各自的状态和计时)，精灵、静态图层和预合成底图全部共用；
+# 房间按原尺寸画进同一块缓冲，再缩放贴进自己的格子。tile 模式整面墙缩放进窗口，scroll 模式按固定缩放排开，窗口是可滚动的视口
+WALL_GAP = 4                    # 格子之间的缝隙
+WALL_BG_COLOR = (40, 36, 34)
+WALL_DOG_COLORS = [DOG_COLOR, (215, 170, 110), (90, 80, 75)]   # 房间轮流换狗狗的毛色
+
+def room_variants(count):
+    return [Room(dog_color=WALL_DOG_COLORS[i % len(WALL_DOG_COLORS)]) for i in range(count)]
+
+class RoomWall:
+    """
+    N 个房间排成网格，接口与 Scene 相同 (update/click/view/mouse_pos)，主循环可以直接换用
+    columns: 每行几个房间 (默认接近正方形)
+    scale: 房间缩放比例；None 为 tile 模式，自动缩小到整面墙放进窗口
+    """
+    def __init__(self, scenes, size=(WIDTH, HEIGHT), columns=None, scale=None):
+        self.scenes = scenes
+        self.room_size = (WIDTH, HEIGHT)
+        self.columns = columns or math.ceil(math.sqrt(len(scenes)))
+        self.rows = math.ceil(len(scenes) / self.columns)
+        self.scroll = (0, 0)
+        self.pointer = (0, 0)  # 见 mouse_pos
+        self.layout(size, scale)
+
+    def layout(self, size, scale=None):
+        room_w, room_h = self.room_size
+        if scale is None:
+            scale = min((size[0] - WALL_GAP * (self.columns + 1)) / self.columns / room_w,
+                        (size[1] - WALL_GAP * (self.rows + 1)) / self.rows / room_h)
+        self.viewport = size
+        self.scale = scale
+        self.tile_size = tile_w, tile_h = max(1, int(room_w * scale)), max(1, int(room_h * scale))
+        self.tiles = [pygame.Rect(WALL_GAP + (i % self.columns) * (tile_w + WALL_GAP),
+                                  WALL_GAP + (i // self.columns) * (tile_h + WALL_GAP), tile_w, tile_h)
+                      for i in range(len(self.scenes))]
+        self.size = (WALL_GAP + self.columns * (tile_w + WALL_GAP), WALL_GAP + self.rows * (tile_h + WALL_GAP))
+        self.scroll_by(0, 0)
+
+    def scroll_by(self, dx, dy):
+        max_x, max_y = max(0, self.size[0] - self.viewport[0]), max(0, self.size[1] - self.viewport[1])
+        self.scroll = (max(0, min(max_x, self.scroll[0] + dx)), max(0, min(max_y, self.scroll[1] + dy)))
+
+    def visible(self, window_rect):
+        """视口里看得见的房间：[(房间序号, 窗口坐标下的格子)]"""
+        viewport = window_rect.move(self.scroll)
+        return [(i, tile.move(-self.scroll[0], -self.scroll[1]))
+                for i, tile in enumerate(self.tiles) if tile.colliderect(viewport)]
+
+    def room_at(self, pos):
+        """窗口坐标 -> (房间序号, 房间内坐标)，不在任何房间上时返回 None"""
+        x, y = pos[0] + self.scroll[0], pos[1] + self.scroll[1]
+        for i, tile in enumerate(self.tiles):
+            if tile.collidepoint(x, y):
+                return i, (int((x - tile.x) / self.scale), int((y - tile.y) / self.scale))
+        return None
+
+    @property
+    def mouse_pos(self):
+        return self.pointer
+
+    @mouse_pos.setter
+    def mouse_pos(self, pos):
+        self.pointer = pos
+        hit = self.room_at(pos)
+        for i, scene in enumerate(self.scenes):
+            scene.mouse_pos = hit[1] if hit and hit[0] == i else (-1, -1)
+
+    @property
+    def particle_count(self):
+        return sum(scene.particle_count for scene in self.scenes)
+
+    @property
+    def initial_anim_done(self):
+        return all(scene.initial_anim_done for scene in self.scenes)
+
+    def set_quality(self, preset):
+        for scene in self.scenes: scene.set_quality(preset)
+
+    def click(self, pos):
+        hit = self.room_at(pos)
+        if hit: self.scenes[hit[0]].click(hit[1])
+
+    def release(self):
+        for scene in self.scenes: scene.release()
 
-        # Layer 6: 氛围层 (光照与粒子 - 最上层，盖住所有物体)
-        light_s = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
-        pygame.draw.polygon(light_s, LIGHT_COLOR, [(0,0), (WIDTH, 0), (WIDTH, 500), (0, HEIGHT)])
-        screen.blit(light_s, (0,0))
-        for p in particles: p.update(); p.draw(screen)
+    def update(self):
+        for scene in self.scenes: scene.update()
 
-        # Layer 7: UI与特效
-        if kiss_timer > 0:
-            mid_x = (girl_x + boy_x) // 2
-            mid_y = (girl_y + boy_y) // 2 - 20
-            scale = 1.0 + math.sin(kiss_timer * 0.2) * 0.2
-            draw_heart(screen, mid_x, mid_y - 30, scale * 0.8)
-            try: font_kiss = pygame.font.SysFont("arial", 24, bold=True)
-            except: font_kiss = pygame.font.Font(None, 30)
-            txt = font_kiss.render("Muah!", True, HEART_COLOR)
-            screen.blit(txt, (mid_x - 20, mid_y - 80 - (60-kiss_timer)))
-
-        if initial_anim_done:
-            for btn in buttons:
-                btn.check_hover(mouse_pos)
-                btn.draw(screen)
-        
-        if initial_anim_done and kiss_timer == 0:
-             heart_scale = 0.6 + math.sin(pygame.time.get_ticks() * 0.003) * 0.05
-             draw_heart(screen, (girl_x + boy_x) // 2, girl_y - 50, heart_scale)
-
-        pygame.display.flip()
-        clock.tick(60)
+    def view(self, alpha):
+        return WallView(self, alpha)
 
+class WallView:
+    """RoomWall 在某个插值比例下的视图，交给 WallRenderer"""
+    def __init__(self, wall, alpha):
+        self.wall = wall
+        self.alpha = alpha
+
+class WallRenderer(SceneRenderer):
+    """
+    一个渲染器画所有房间：房间依次整屏画进同一块房间缓冲，再缩放到格子大小贴到窗口上
+    (每个房间的粒子都不一样，跨房间按脏矩形重画反而更慢)
+    refresh_budget: 每帧最多重画几个房间，其余格子保留上一帧的画面 (None 为全部重画)
+    格子本身就是缩小的，render_scale 在这里不起作用
+    """
+    def __init__(self, layers=None, refresh_budget=None):
+        super().__init__(layers, dirty_rects=False)
+        self.refresh_budget = refresh_budget
+        self.cursor = 0
+        self.scroll = None
+        self.buffer = None
+        self.tile_buffer = None
+
+    def render(self, surface, view):
+        wall = view.wall
+        if self.buffer is None:
+            self.buffer = to_display_format(new_surface(wall.room_size), alpha=False)
+        visible = wall.visible(surface.get_rect())
+        if self.force_full or self.refresh_budget is None or wall.scroll != self.scroll:
+            self.force_full = False
+            self.scroll = wall.scroll
+            surface.fill(WALL_BG_COLOR)
+            todo = visible
+        else:
+            # 轮流重画，每个房间隔几帧更新一次
+            count = min(self.refresh_budget, len(visible))
+            todo = [visible[(self.cursor + k) % len(visible)] for k in range(count)]
+            self.cursor = (self.cursor + count) % max(1, len(visible))
+
+        for index, dest in todo:
+            self.draw_full(self.buffer, wall.scenes[index].view(view.alpha))
+            start = time.perf_counter()
+            if dest.size == self.buffer.get_size():
+                surface.blit(self.buffer, dest)
+            else:
+                if self.tile_buffer is None or self.tile_buffer.get_size() != dest.size:
+                    self.tile_buffer = to_display_format(new_surface(dest.size), alpha=False)
+                pygame.transform.scale(self.buffer, dest.size, self.tile_buffer)
+                surface.blit(self.tile_buffer, dest)
+            if self.layer_times is not None:
+                self.layer_times["wall"] = self.layer_times.get("wall", 0.0) + time.perf_counter() - start
+        self.present(surface)
+        return None
+
+# --- 11. 基准测试 ---
+# python hugbb_v0.py --benchmark [--frames N] [--dirty-rects] [--out result.json]
+# 在 dummy 视频驱动下不限帧率地跑完固定的场景脚本，按图层输出帧耗时统计 (JSON)
+BENCH_FRAMES = 120   # 每个阶段的帧数 (开场动画跑到结束为止)
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(samples):
+    """samples: 秒 -> 毫秒统计"""
+    values = sorted(v * 1000.0 for v in samples)
+    return {
+        "mean_ms": round(sum(values) / len(values), 4) if values else 0.0,
+        "p50_ms": round(percentile(values, 50), 4),
+        "p95_ms": round(percentile(values, 95), 4),
+        "p99_ms": round(percentile(values, 99), 4),
+    }
+
+def benchmark_script(scene, frames):
+    """按阶段产出 (阶段名, 点击位置或 None)：开场动画 -> 空闲 -> 回抱 -> Fred 亲 -> AvA 亲"""
+    buttons = {btn.action_code: btn.rect.center for btn in scene.buttons}
+    while not scene.initial_anim_done:
+        yield "intro", None
+    for _ in range(frames):
+        yield "idle", None
+    yield "hug_back", buttons["hug_back"]
+    for _ in range(frames - 1):
+        yield "hug_back", None
+    for phase, action in (("boy_kiss", "boy_kiss"), ("girl_kiss", "girl_kiss")):
+        for _ in range(frames):
+            # 亲亲只持续 60 帧，结束后重新点一次，保持在亲亲状态
+            yield phase, buttons[action] if scene.kiss_timer == 0 else None
+
+def run_benchmark(frames=BENCH_FRAMES, dirty_rects=False, surface=None, quality=QUALITY, render_scale=None,
+                  atlas=True):
+    surface = surface or app.display()
+    start = time.perf_counter()
+    scene = Scene()
+    renderer = SceneRenderer(dirty_rects=dirty_rects)
+    QualityController(scene, renderer, quality, render_scale=render_scale)
+    atlas_loaded = atlas and load_atlas()
+    prebake_breath_cycles()
+    intro_roll(scene.animation_speed).prebake(scene)
+    warmup = time.perf_counter() - start
+
+    layer_samples, frame_samples, phase_samples = {}, [], {}
+    # 每帧正好一步模拟 (scene.ticks 走的是模拟时间)，不受实际耗时影响
+    for phase, click in benchmark_script(scene, frames):
+        pygame.event.pump()
+        frame_start = time.perf_counter()
+        if click:
+            scene.tap(click)
+        renderer.layer_times = {}
+        update_start = time.perf_counter()
+        scene.update()
+        renderer.layer_times["update"] = time.perf_counter() - update_start
+        renderer.render(surface, scene)
+        elapsed = time.perf_counter() - frame_start
+
+        for group, seconds in renderer.layer_times.items():
+            layer_samples.setdefault(group, []).append(seconds)
+        frame_samples.append(elapsed)
+        phase_samples.setdefault(phase, []).append(elapsed)
+
+    # 某一帧没画到的图层按 0 计，保证每个图层的样本数一致
+    for samples in layer_samples.values():
+        samples.extend([0.0] * (len(frame_samples) - len(samples)))
+    return {
+        "frames": len(frame_samples),
+        "dirty_rects": dirty_rects,
+        "quality": quality,
+        "render_scale": renderer.render_scale,
+        "resolution": list(surface.get_size()),
+        "video_driver": pygame.display.get_driver(),
+        "pygame": pygame.version.ver,
+        "numpy": np is not None,
+        "particles": scene.particles.count,
+        "warmup_ms": round(warmup * 1000.0, 3),
+        "startup": app.report(),
+        "atlas": bool(atlas_loaded),
+        "frame": summarize(frame_samples),
+        "phases": {phase: summarize(samples) for phase, samples in phase_samples.items()},
+        "layers": {group: summarize(samples) for group, samples in layer_samples.items()},
+    }
+
+STRESS_ROOMS = (1, 10, 100)
+
+def run_room_benchmark(counts=STRESS_ROOMS, frames=BENCH_FRAMES, surface=None, refresh_budget=None):
+    """多房间压力测试：每种房间数铺满窗口，开场动画跑完后计时 frames 帧空闲状态"""
+    surface = surface or app.display()
+    rooms = {}
+    for count in counts:
+        start = time.perf_counter()
+        wall = RoomWall([Scene(room=room) for room in room_variants(count)], surface.get_size())
+        renderer = WallRenderer(refresh_budget=refresh_budget)
+        while not wall.initial_anim_done:
+            wall.update()
+        renderer.render(surface, wall.view(0))   # 第一帧会生成共享的精灵，算在准备时间里
+        setup = time.perf_counter() - start
+
+        frame_samples, update_samples = [], []
+        for _ in range(frames):
+            pygame.event.pump()
+            frame_start = time.perf_counter()
+            wall.update()
+            update_samples.append(time.perf_counter() - frame_start)
+            renderer.render(surface, wall.view(0))
+            frame_samples.append(time.perf_counter() - frame_start)
+        frame = summarize(frame_samples)
+        rooms[str(count)] = {
+            "tile": list(wall.tile_size),
+            "setup_ms": round(setup * 1000.0, 3),
+            "frame": frame,
+            "update": summarize(update_samples),
+            "per_room_ms": round(frame["mean_ms"] / count, 4),
+        }
+    return {
+        "frames": frames,
+        "refresh_budget": refresh_budget,
+        "resolution": list(surface.get_size()),
+        "video_driver": pygame.display.get_driver(),
+        "pygame": pygame.version.ver,
+        "numpy": np is not None,
+        "rooms": rooms,
+        # 所有房间共用的缓存，条目数不随房间数增长
+        "shared": {
+            "static_layers": len(static_layer_sets),
+            "breath_cycles": len(breath_cycles),
+            "character_sprites": len(character_sprites),
+            "heart_sprites": len(heart_sprites),
+        },
+    }
+
+# --- 12. 离线导出 ---
+# python hugbb_v0.py --export frames/ [--seconds 10] [--workers N] [--video clip.mp4]
+# 按固定剧本 (开场 -> 回抱 -> 两次亲亲 -> 松开) 无窗口逐帧渲染：random 用固定种子，时间用模拟时间，
+# 所以任意一段帧都能单独重现。帧范围切成小段分给进程池，每个进程从第 0 步快进 (只模拟不画) 到自己那一段
+EXPORT_SEED = 1
+EXPORT_SECONDS = 10
+EXPORT_CHUNK = 30                  # 每个任务渲染的帧数
+EXPORT_PATTERN = "frame_%05d.png"
+# 剧本：(模拟步, 按钮)；开场翻滚大约 100 步
+EXPORT_TIMELINE = [(160, "hug_back"), (260, "boy_kiss"), (360, "girl_kiss"), (480, "hug_back")]
+
+def render_export_chunk(job):
+    """
+    进程池任务：渲染 [start, end) 帧，out_dir 不为空时写 PNG；
+    返回每帧的 RGB 字节 (want_bytes=True，交给编码器) 或帧数
+    """
+    seed, start, end, steps_per_frame, out_dir, want_bytes, quality = job
+    app.display()   # 子进程里也开一个 (dummy) 窗口，烘焙出的精灵和主进程一样转成屏幕格式
+    random.seed(seed)
+    scene = Scene()
+    renderer = SceneRenderer()
+    QualityController(scene, renderer, quality)
+    load_atlas()
+    surface = to_display_format(new_surface((WIDTH, HEIGHT)), alpha=False)
+    clicks = dict(EXPORT_TIMELINE)
+    buttons = {btn.action_code: btn.rect.center for btn in scene.buttons}
+    frames = []
+    step = 0
+    for frame in range(end):
+        for _ in range(steps_per_frame):
+            action = clicks.get(step)
+            if action:
+                scene.tap(buttons[action])
+            scene.update()
+            step += 1
+        if frame < start:
+            continue
+        renderer.draw(surface, scene)
+        if out_dir: pygame.image.save(surface, os.path.join(out_dir, EXPORT_PATTERN % frame))
+        if want_bytes: frames.append(pygame.image.tostring(surface, "RGB"))
+    return frames if want_bytes else end - start
+
+def encoder_command(path, fps):
+    """把原始 RGB 帧从 stdin 编码成视频/GIF (格式由扩展名决定)"""
+    import shutil
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("--video 需要 PATH 里有 ffmpeg")
+    return [ffmpeg, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24",
+            "-s", "%dx%d" % (WIDTH, HEIGHT), "-r", str(fps), "-i", "-", path]
+
+def export_frames(out_dir=None, video=None, seconds=EXPORT_SECONDS, start=0, end=None, fps=SIM_HZ,
+                  workers=None, seed=EXPORT_SEED, quality=QUALITY):
+    """
+    导出 [start, end) 帧 (end 为空时导出 seconds 秒)；fps 为导出帧率，每帧推进 SIM_HZ // fps 步模拟
+    workers: 进程数 (默认 CPU 核数)，1 时在当前进程里渲染
+    """
+    import multiprocessing, subprocess
+    steps_per_frame = max(1, SIM_HZ // fps)
+    fps = SIM_HZ // steps_per_frame
+    end = int(seconds * fps) if end is None else end
+    jobs = [(seed, first, min(first + EXPORT_CHUNK, end), steps_per_frame, out_dir, video is not None, quality)
+            for first in range(start, end, EXPORT_CHUNK)]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    if out_dir: os.makedirs(out_dir, exist_ok=True)
+    encoder = subprocess.Popen(encoder_command(video, fps), stdin=subprocess.PIPE) if video else None
+
+    begin = time.perf_counter()
+    if workers > 1:
+        # spawn 出来的进程重新导入本模块，用 dummy 视频驱动
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+        pool = multiprocessing.get_context("spawn").Pool(workers)
+        results = pool.imap(render_export_chunk, jobs)   # 按顺序返回，可以直接写进编码器
+    else:
+        pool, results = None, map(render_export_chunk, jobs)
+    try:
+        for result in results:
+            if encoder:
+                for frame in result: encoder.stdin.write(frame)
+    finally:
+        if pool: pool.close(); pool.join()
+        if encoder:
+            encoder.stdin.close()
+            encoder.wait()
+    return {
+        "frames": max(0, end - start),
+        "fps": fps,
+        "seed": seed,
+        "workers": workers,
+        "chunks": len(jobs),
+        "elapsed_s": round(time.perf_counter() - begin, 3),
+        "out_dir": out_dir,
+        "video": video,
+    }
+
+# --- 13. 精灵图集 ---
+# python hugbb_v0.py --bake-atlas：构建时把程序绘制的精灵 (被子和植物图层、叶片、呼吸帧、人物、爱心、按钮)
+# 打包成一张 PNG 和一个 JSON 索引。启动时读一张图就能填满各个缓存；图集不存在，或者绘制代码/配色的哈希
+# 对不上 (图集过期) 时，照常现画。
+# 整屏的不透明底图和光照贴图不进图集：解码它们比直接画还慢，读图集时顺手重画底图
+# 按钮文字用的是系统字体，所以图集要在运行它的平台上烘焙 (打包流程里烘焙，或者本地跑一次 --bake-atlas)
+ATLAS_DIR = getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__)))   # PyInstaller 解包目录
+ATLAS_PATH = os.path.join(ATLAS_DIR, "hugbb_atlas.png")   # 索引在同名的 .json 里
+ATLAS_MAX_WIDTH = 2048   # 打包时在不超过这个宽度的范围里挑总面积最小的宽度 (解码时间和像素数成正比)
+ATLAS_PADDING = 1
+
+def atlas_sources():
+    """图集里的内容取决于这些函数/类的代码"""
+    return [draw_room_bg, draw_bed, draw_blanket, render_exquisite_leaf, LeafSpriteCache, draw_fiddle_leaf_fig,
+            fiddle_leaf_layout,
+            render_sleeping_cat, render_sleeping_dog, BreathCycle, draw_pill_shape, draw_glasses, draw_hair_boy,
+            draw_hair_girl_long, draw_face, character_canvas, render_girl_sprite, render_boy_sprite,
+            render_hug_arm_sprite, heart_geometry, quantize_alpha, render_heart, render_button,
+            StaticLayers, WindowLight, LampLight, LightingEngine, scale_surface, crop_to_content, load_font, get_font,
+            TextCache, render_text]
+
+def atlas_palette():
+    return (scene_palette(), leaf_palette(), SKIN_COLOR, BLUSH_COLOR, BOY_HAIR, GIRL_HAIR, GLASSES_COLOR,
+            BOY_CLOTHES, GIRL_CLOTHES, CAT_COLOR, CAT_STRIPE, DOG_COLOR, HEART_COLOR, BUTTON_COLOR,
+            BUTTON_HOVER_COLOR, BUTTON_PRESSED_COLOR, TEXT_COLOR, SHADOW_COLOR, LIGHT_COLOR, BUTTON_FONT,
+            (WIDTH, HEIGHT), BREATH_FRAMES, HEART_ALPHA_STEPS, CHAR_ANCHOR, CHAR_SIZE)
+
+def code_digest(digest, code):
+    """把字节码、常量和引用的名字喂给哈希 (不依赖源码和行号，打包成 .pyc 也能用)"""
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode("utf-8"))
+    for const in code.co_consts:
+        if hasattr(const, "co_code"): code_digest(digest, const)
+        else: digest.update(repr(const).encode("utf-8"))
+
+def function_digest(digest, function):
+    """代码加上参数默认值 (改了 amplitude=0.015 这种默认参数，画出来的也不一样)"""
+    code_digest(digest, function.__code__)
+    kwdefaults = function.__kwdefaults__ or {}
+    defaults = list(function.__defaults__ or ()) + [x for name in sorted(kwdefaults) for x in (name, kwdefaults[name])]
+    for value in defaults:
+        # 默认值是函数时 repr 里带内存地址，每次启动都不同，改为哈希它的代码
+        if hasattr(value, "__code__"): function_digest(digest, value)
+        else: digest.update(repr(value).encode("utf-8"))
+
+def source_functions(source):
+    """函数本身，或者类里按名字排好序的方法 (property/staticmethod/classmethod 取出里面的函数)"""
+    if hasattr(source, "__code__"): return [source]
+    functions = []
+    for name in sorted(vars(source)):
+        member = vars(source)[name]
+        if isinstance(member, property): member = member.fget
+        member = getattr(member, "__func__", member)
+        if hasattr(member, "__code__"): functions.append(member)
+    return functions
+
+def atlas_hash():
+    """绘制代码和配色的内容哈希，任何一处改动都会让旧图集失效"""
+    import hashlib
+    digest = hashlib.sha1()
+    for source in atlas_sources():
+        for function in source_functions(source):
+            function_digest(digest, function)
+    digest.update(repr(atlas_palette()).encode("utf-8"))
+    return digest.hexdigest()
+
+def as_key(value):
+    """JSON 里的列表还原成元组 (缓存键都是元组)"""
+    return tuple(as_key(v) for v in value) if isinstance(value, list) else value
+
+def collect_atlas_sprites():
+    """
+    按正常的绘制路径把缓存填满，返回 [(分组, 键, 表面, 锚点)]
+    人物、按钮、亲亲爱心跟着导出剧本跑一遍；按钮的各种状态、爱心粒子的 (尺寸, 透明度) 档位逐个生成
+    """
+    app.display()
+    random.seed(EXPORT_SEED)
+    scene = Scene()
+    renderer = SceneRenderer()
+    surface = to_display_format(new_surface((WIDTH, HEIGHT)), alpha=False)
+    for cycle in (cat_breath_cycle(), dog_breath_cycle()):
+        if cycle.frames is None: cycle.build()
+    clicks = dict(EXPORT_TIMELINE)
+    buttons = {btn.action_code: btn.rect.center for btn in scene.buttons}
+    for step in range(EXPORT_SECONDS * SIM_HZ):
+        if step in clicks:
+            scene.tap(buttons[clicks[step]])
+        scene.update()
+        if scene.initial_anim_done: renderer.draw(surface, scene)
+    for btn in scene.buttons:
+        for state in BUTTON_STATES:
+            btn.sprite(state)
+    for scale, alpha in heart_sprite_specs():
+        heart_sprite(scale, alpha)
+
+    sprites = []
+    static = scene.static_layers
+    for name, (surf, pos) in static.layers.items():
+        if name != "back":
+            sprites.append(("static", [static.pillows, static.plant_pos, static.key, name], surf, pos))
+    for name, cycle in (("cat", cat_breath_cycle()), ("dog", dog_breath_cycle())):
+        unique = list({id(frame): frame for frame in cycle.frames}.values())
+        for frame in unique:
+            sprites.append(("breath", [name, [unique.index(f) for f in cycle.frames]], frame, None))
+    for key, (surf, offset) in leaf_sprites.entries.items():
+        sprites.append(("leaf", key, surf, offset))
+    for group, cache in (("character", character_sprites), ("heart", heart_sprites)):
+        for key, (surf, anchor) in cache.entries.items():
+            sprites.append((group, key, surf, anchor))
+    for key, surf in button_sprites.entries.items():
+        sprites.append(("button", key, surf, None))
+    return sprites
+
+def pack_shelves(sizes, width, padding=ATLAS_PADDING):
+    """按高度从高到低一行一行摆放 (shelf packing)，返回 (每个矩形的位置, 总高度)"""
+    order = sorted(range(len(sizes)), key=lambda i: -sizes[i][1])
+    positions = [None] * len(sizes)
+    x = y = shelf_h = 0
+    for i in order:
+        w, h = sizes[i]
+        if x + w > width:
+            x, y, shelf_h = 0, y + shelf_h + padding, 0
+        positions[i] = (x, y)
+        x += w + padding
+        shelf_h = max(shelf_h, h)
+    return positions, y + shelf_h
+
+def pack_atlas(sizes, max_width=ATLAS_MAX_WIDTH):
+    """返回 (位置, 图集尺寸)"""
+    widest = max(w for w, _ in sizes)
+    best = None
+    for width in range(widest, max(widest, max_width) + 1, 16):
+        positions, height = pack_shelves(sizes, width)
+        used = max(x + w for (x, _), (w, _) in zip(positions, sizes))
+        if best is None or used * height < best[1][0] * best[1][1]:
+            best = positions, (used, height)
+    return best
+
+def bake_atlas(path=ATLAS_PATH):
+    start = time.perf_counter()
+    sprites = collect_atlas_sprites()
+    sizes = [surf.get_size() for _, _, surf, _ in sprites]
+    positions, size = pack_atlas(sizes)
+    atlas = new_surface(size, pygame.SRCALPHA)
+    entries = []
+    for (group, key, surf, anchor), (x, y), (w, h) in zip(sprites, positions, sizes):
+        atlas.blit(surf, (x, y), special_flags=pygame.BLEND_RGBA_MAX)   # 原样拷贝像素 (含 alpha)，不做混合
+        entries.append([group, key, [x, y, w, h], anchor])
+    pygame.image.save(atlas, path)
+    index = {"hash": atlas_hash(), "settings": dict(quality_settings), "sprites": entries}
+    with open(os.path.splitext(path)[0] + ".json", "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+    return {"path": path, "sprites": len(entries), "size": list(atlas.get_size()),
+            "bake_ms": round((time.perf_counter() - start) * 1000.0, 3)}
+
+atlas_stats = {"sprites": 0, "bytes": 0}   # 已载入的图集 (切片和图集共用像素，内存统计单独算它)
+
+def load_atlas(path=ATLAS_PATH):
+    """读入图集填充各个精灵缓存；图集不存在或已过期时返回 False"""
+    try:
+        with open(os.path.splitext(path)[0] + ".json") as f:
+            index = json.load(f)
+        if index.get("hash") != atlas_hash() or index.get("settings") != quality_settings:
+            return False
+        atlas = to_display_format(pygame.image.load(path), alpha=True)
+    except (OSError, ValueError, pygame.error):
+        return False
+
+    breath = {}
+    for group, key, rect, anchor in index["sprites"]:
+        surf = atlas.subsurface(rect)
+        key, anchor = as_key(key), as_key(anchor)
+        if group == "static":
+            pillows, plant_pos, layers_key, name = key
+            layers = get_static_layers(pillows, plant_pos)
+            if layers.key != layers_key:
+                layers.rebuild_back(layers_key[0])
+                layers.key = layers_key
+            layers.layers[name] = (surf, anchor)
+        elif group == "breath":
+            name, frame_index = key
+            breath.setdefault(name, (frame_index, []))[1].append(surf)
+        elif group == "leaf":
+            leaf_sprites.put(key, (surf, anchor))
+        elif group == "character":
+            character_sprites.put(key, (surf, anchor))
+        elif group == "heart":
+            heart_sprites.put(key, (surf, anchor))
+        elif group == "button":
+            button_sprites.put(key, surf)
+    for name, cycle in (("cat", cat_breath_cycle()), ("dog", dog_breath_cycle())):
+        if name in breath:
+            frame_index, unique = breath[name]
+            cycle.frames = [unique[i] for i in frame_index]
+    atlas_stats.update(sprites=len(index["sprites"]), bytes=surface_bytes(atlas))
+    return True
+
+# --- 14. 录制与回放 ---
+# --record FILE 把一局的输入按模拟步记成 JSON Lines：第一行是头 (随机种子和启动参数)，之后每行一条
+# [步数, 类型, 参数...]：m 鼠标移到 (x, y)，c 按下，u 松开，k 按键，w 滚轮，p 画质换档，e 结束 (附带状态摘要)。
+# 模拟是固定步长的，scene.ticks 是模拟时间，所以同样的种子、在同样的步数送进同样的输入，状态就完全一致。
+# --replay FILE 无窗口、不限帧率地重放 (每步模拟画一帧)，报告帧耗时统计，可以拿真实的一局当性能回归测试
+REPLAY_VERSION = 2   # 2: 鼠标位置来自 MOUSEMOTION 事件，加了松开 (u)
+
+MOUSE_BUTTONS = (1, 2, 3)
+
+def input_actions(event):
+    """把 pygame 事件翻译成输入动作 (录制和回放用的就是这些元组)"""
+    if event.type == pygame.MOUSEMOTION: return [("m",) + tuple(event.pos)]
+    # pygame 2 的滚轮每一格也会发 4/5 号键的按下/松开，只认左中右键，滚动墙时不会误点按钮
+    if event.type == pygame.MOUSEBUTTONDOWN and event.button in MOUSE_BUTTONS:
+        return [("m",) + tuple(event.pos), ("c",)]
+    if event.type == pygame.MOUSEBUTTONUP and event.button in MOUSE_BUTTONS: return [("u",)]
+    if event.type == pygame.KEYDOWN: return [("k", event.key)]
+    if event.type == pygame.MOUSEWHEEL: return [("w", event.x, event.y)]
+    return []
+
+def apply_action(scene, renderer, perf_hud, action):
+    """主循环和回放共用的输入处理"""
+    kind = action[0]
+    if kind == "m":
+        scene.mouse_pos = tuple(action[1:])
+    elif kind == "c":
+        scene.click(scene.mouse_pos)
+    elif kind == "u":
+        scene.release()
+    elif kind == "k" and action[1] == HUD_KEY and perf_hud:
+        perf_hud.toggle(renderer)
+    elif kind == "w" and isinstance(scene, RoomWall):
+        scene.scroll_by(-action[1] * 60, -action[2] * 60)
+
+def scene_checksum(scene, digest):
+    """把模拟状态喂给 digest"""
+    for room in getattr(scene, "scenes", [scene]):
+        hearts = room.hearts
+        state = (room.ticks, room.progress, room.boy_x, room.current_boy_y, room.boy_offset, room.girl_offset,
+                 room.girl_is_hugging_back, room.kiss_action, room.kiss_timer,
+                 [(hearts.x[i], hearts.y[i], hearts.life[i]) for i in hearts.active],
+                 [tuple(rect) for rect in room.particles.rects(room.particles.count)])
+        digest.update(repr(state).encode("utf-8"))
+
+class StateDigest:
+    """
+    每个非鼠标动作之前和结束时的状态摘要；录制和回放各算一份，
+    一致说明重放走的是同一条路径 (只比最终状态不够：抱抱、亲亲结束后状态会收敛)
+    """
+    def __init__(self):
+        import hashlib
+        self.digest = hashlib.sha1()
+
+    def checkpoint(self, scene, action=None):
+        if action is None or action[0] != "m":
+            scene_checksum(scene, self.digest)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+class InputRecorder:
+    """把输入动作按模拟步写进文件；鼠标位置只在变化时记一条"""
+    def __init__(self, path, header):
+        self.file = open(path, "w")
+        self.mouse = None
+        self.state = StateDigest()
+        self.quality = header.get("quality")
+        self.write(dict(header, version=REPLAY_VERSION))
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def record(self, step, action, scene):
+        """在 apply_action 之前调用"""
+        if action[0] == "m":
+            if action == self.mouse:
+                return
+            self.mouse = action
+        self.state.checkpoint(scene, action)
+        self.write([step, *action])
+
+    def record_quality(self, step, name, scene):
+        """自适应画质换档也会改变状态 (粒子数)，回放时要在同一步换；在换档之后调用"""
+        if name != self.quality:
+            self.quality = name
+            self.record(step, ("p", name), scene)
+
+    def close(self, step, scene):
+        self.state.checkpoint(scene)
+        self.write([step, "e", self.state.hexdigest()])
+        self.file.close()
+
+def create_scene(rooms=1, wall_scale=None, dirty_rects=DIRTY_RECTS, refresh_budget=None, size=(WIDTH, HEIGHT)):
+    """按启动参数建场景和对应的渲染器 (单个房间或房间墙)"""
+    if rooms > 1:
+        scene = RoomWall([Scene(room=room) for room in room_variants(rooms)], size, scale=wall_scale)
+        return scene, WallRenderer(refresh_budget=refresh_budget)
+    return Scene(), SceneRenderer(dirty_rects=dirty_rects)
+
+def load_recording(path):
+    """返回 (头, 动作记录列表)"""
+    with open(path) as f:
+        header = json.loads(f.readline())
+        records = [json.loads(line) for line in f if line.strip()]
+    if header.get("version") != REPLAY_VERSION:
+        raise ValueError("unsupported recording version: %r" % header.get("version"))
+    return header, records
+
+def run_replay(path, surface=None, atlas=True):
+    """不限帧率地重放一份录制，返回帧耗时统计"""
+    header, records = load_recording(path)
+    surface = surface or app.display()
+    start = time.perf_counter()
+    random.seed(header["seed"])
+    if header.get("hour") is not None:
+        default_lighting.time_of_day = True
+        default_lighting.clock = lambda: header["hour"]
+    set_lamp(header.get("lamp", False))
+    scene, renderer = create_scene(header["rooms"], header.get("wall_scale"), header.get("dirty_rects", False),
+                                   header.get("refresh_budget"), surface.get_size())
+    controller = QualityController(scene, renderer, header["quality"], render_scale=header.get("render_scale"))
+    atlas_loaded = atlas and load_atlas()
+    prebake_breath_cycles()
+    warmup = time.perf_counter() - start
+
+    end_step, checksum = (records[-1][0], records[-1][2]) if records and records[-1][1] == "e" else \
+        (records[-1][0] if records else 0, None)
+    actions = deque(records)
+    state = StateDigest()
+    layer_samples, frame_samples = {}, []
+    for step in range(end_step + 1):
+        pygame.event.pump()
+        frame_start = time.perf_counter()
+        while actions and actions[0][0] <= step and actions[0][1] != "e":
+            action = actions.popleft()[1:]
+            if action[0] == "p":
+                controller.apply(QUALITY_PRESETS.index(quality_preset(action[1])))
+                state.checkpoint(scene, action)   # 录制时是在换档之后记的
+            else:
+                state.checkpoint(scene, action)
+                # 回放是干净的性能测量，不画性能面板 (录制时的 --hud 和 F3 都忽略，不影响模拟状态)
+                apply_action(scene, renderer, None, action)
+        if step == end_step:
+            break
+        renderer.layer_times = {}
+        update_start = time.perf_counter()
+        scene.update()
+        renderer.layer_times["update"] = time.perf_counter() - update_start
+        renderer.render(surface, scene.view(0))
+        frame_samples.append(time.perf_counter() - frame_start)
+        for group, seconds in renderer.layer_times.items():
+            layer_samples.setdefault(group, []).append(seconds)
+
+    for samples in layer_samples.values():
+        samples.extend([0.0] * (len(frame_samples) - len(samples)))
+    state.checkpoint(scene)
+    return {
+        "recording": path,
+        "steps": end_step,
+        "actions": len(records) - (checksum is not None),
+        "deterministic": None if checksum is None else state.hexdigest() == checksum,
+        "rooms": header["rooms"],
+        "quality": header["quality"],
+        "dirty_rects": header.get("dirty_rects", False),
+        "video_driver": pygame.display.get_driver(),
+        "atlas": bool(atlas_loaded),
+        "warmup_ms": round(warmup * 1000.0, 3),
+        "replay_ms": round(sum(frame_samples) * 1000.0, 3),
+        "frame": summarize(frame_samples),
+        "layers": {group: summarize(samples) for group, samples in layer_samples.items()},
+        "memory": memory_report(),
+    }
+
+# --- 15. 性能面板与分析钩子 ---
+# F3 切换屏幕左上角的性能面板；add_frame_hook 注册的回调每帧收到一条计时记录，
+# 外部分析器/日志可以订阅；RollingTrace 把每帧的记录追加写入文件并轮换 (JSON Lines)，
+# MemoryMonitor 每隔一段时间写一行内存汇总 (--memory-log)
+HUD_KEY = pygame.K_F3
+HUD_FONT = ("consolas", 14, False, 18)
+
+frame_hooks = []
+
+def add_frame_hook(hook):
+    """hook(record) 每帧调用一次，record 见 FrameProfiler.end_frame"""
+    frame_hooks.append(hook)
+    return hook
+
+def remove_frame_hook(hook):
+    if hook in frame_hooks:
+        frame_hooks.remove(hook)
+
+class FrameProfiler:
+    """给渲染器打开分图层计时，每帧汇总成一条记录并分发给 frame_hooks"""
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.frame = 0
+        self.frame_start = 0.0
+        self.last_frame_end = None
+        self.last_record = None
+
+    def begin_frame(self):
+        self.frame_start = time.perf_counter()
+        self.renderer.layer_times = {}
+        surface_stats["count"] = surface_stats["bytes"] = 0
+
+    def time_update(self, update):
+        start = time.perf_counter()
+        update()
+        self.renderer.layer_times["update"] = time.perf_counter() - start
+
+    def end_frame(self, scene):
+        now = time.perf_counter()
+        # 帧间隔包括 clock.tick 的等待，用来算真实 FPS；frame_ms 只算本帧的工作量
+        interval = now - self.last_frame_end if self.last_frame_end is not None else now - self.frame_start
+        self.last_frame_end = now
+        record = {
+            "frame": self.frame,
+            "time": now,
+            "frame_ms": (now - self.frame_start) * 1000.0,
+            "fps": 1.0 / interval if interval > 0 else 0.0,
+            "layers_ms": {group: seconds * 1000.0 for group, seconds in self.renderer.layer_times.items()},
+            "surfaces": surface_stats["count"],
+            "surface_bytes": surface_stats["bytes"],
+            "particles": scene.particle_count,
+        }
+        self.frame += 1
+        self.last_record = record
+        for hook in list(frame_hooks):
+            hook(record)
+        return record
+
+class PerfHUD:
+    """
+    屏幕上的性能面板，作为渲染器的 overlay 画在最上层
+    脏矩形模式下面板下面的画面不会重画，所以面板只会变大不会缩小：出现过的图层分组一直列着 (没画时 0 ms)，
+    底框取历次矩形的并集，新面板总能盖住旧的
+    """
+    def __init__(self, profiler, visible=False, pos=(8, 8)):
+        self.profiler = profiler
+        self.visible = visible
+        self.pos = pos
+        self.groups = set()
+        self.rect = None
+
+    def toggle(self, renderer):
+        self.visible = not self.visible
+        self.rect = None
+        renderer.invalidate()   # 关掉时需要整屏重画把面板擦掉
+
+    def lines(self):
+        record = self.profiler.last_record
+        if record is None:
+            return ["waiting for first frame..."]
+        lines = [
+            "FPS %5.1f   frame %5.2f ms" % (record["fps"], record["frame_ms"]),
+            "surfaces/frame %d (%.1f KB)" % (record["surfaces"], record["surface_bytes"] / 1024.0),
+            "caches %.1f / %.0f MB" % (cache_budget.total() / MB, cache_budget.limit / MB),
+            "particles %d" % record["particles"],
+        ]
+        self.groups.update(record["layers_ms"])
+        layers_ms = dict.fromkeys(self.groups, 0.0)
+        layers_ms.update(record["layers_ms"])
+        for group, ms in sorted(layers_ms.items(), key=lambda item: (-item[1], item[0])):
+            lines.append("  %-11s %6.3f ms" % (group, ms))
+        return lines
+
+    def __call__(self, surface):
+        if not self.visible:
+            return None
+        # 面板文字每帧都变，直接用字体渲染，不挤占共享的文字缓存，也不计入表面分配
+        font = get_font(*HUD_FONT)
+        texts = [font.render(line, True, TEXT_COLOR) for line in self.lines()]
+        line_h = max(t.get_height() for t in texts)
+        width = max(t.get_width() for t in texts) + 12
+        rect = pygame.Rect(self.pos, (width, line_h * len(texts) + 8))
+        if self.rect is not None: rect.union_ip(self.rect)
+        self.rect = rect
+        pygame.draw.rect(surface, (20, 20, 25), rect)
+        for i, t in enumerate(texts):
+            surface.blit(t, (rect.x + 6, rect.y + 4 + i * line_h))
+        return rect
+
+class RollingTrace:
+    """
+    每帧往 path 追加一行；写满 max_records 行就把它改名成 path.1 (顶掉更早的那份) 再从头写，
+    磁盘上始终保留最近 max_records 到 2 * max_records 帧。每帧只序列化一条记录，不会周期性地卡一下；
+    文件按行缓冲，进程被杀掉时最后那几帧 (往往就是要抓的卡顿) 也已经写进去了
+    """
+    def __init__(self, path, max_records=3600):
+        self.path = path
+        self.max_records = max_records
+        self.file = open(path, "w", buffering=1)
+        self.count = 0
+
+    def __call__(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.count += 1
+        if self.count >= self.max_records:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        os.replace(self.path, self.path + ".1")
+        self.file = open(self.path, "w", buffering=1)
+        self.count = 0
+
+    def close(self):
+        self.file.close()
+        remove_frame_hook(self)
+
+MB = 1024.0 * 1024.0
+MEMORY_LOG_INTERVAL = 60.0   # 秒
+
+def process_rss():
+    """进程当前的常驻内存 (字节)；拿不到 (非 Linux、浏览器里) 时返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def memory_report():
+    """
+    内存汇总 (字节)：caches 是各 LRU 缓存 (同名的合在一起，例如每个渲染器的节点缓存)，受 cache_budget 限制；
+    resident 是按房间布局/画质建好后就不再增长的精灵 (静态图层、呼吸帧、粒子点、图集)
+    """
+    caches = {}
+    for cache in list(cache_budget.caches):
+        stats = caches.setdefault(cache.name or "unnamed", dict.fromkeys(
+            ("count", "entries", "bytes", "hits", "misses", "evictions"), 0))
+        stats["count"] += 1
+        for name, value in cache.stats().items():
+            if name in stats: stats[name] += value
+    seen = set()
+    resident = {
+        "static_layers": sum(entry_bytes(layers.layers, seen) for layers in static_layer_sets.values()),
+        "breath_cycles": sum(entry_bytes([cycle.base, cycle.frames], seen) for cycle in breath_cycles.values()
+                             if cycle.frames is not None),
+        "intro_rolls": sum(entry_bytes(roll.frames, seen) for roll in intro_rolls.values()),
+        "dust": entry_bytes(dust_sprite_sets, seen),
+        "atlas": atlas_stats["bytes"],
+    }
+    return {
+        "cache_bytes": sum(stats["bytes"] for stats in caches.values()),
+        "cache_budget": cache_budget.limit,
+        "cache_peak": cache_budget.peak,
+        "budget_evictions": cache_budget.evictions,
+        "resident_bytes": sum(resident.values()),
+        "surfaces_allocated": surface_stats["total_count"],
+        "surface_bytes_allocated": surface_stats["total_bytes"],
+        "rss": process_rss(),
+        "caches": dict(sorted(caches.items())),
+        "resident": resident,
+    }
+
+class MemoryMonitor:
+    """
+    长时间运行 (展台) 用的内存诊断，作为帧钩子注册：每 interval 秒把一行 JSON 追加到 path (None 为标准错误)，
+    内容是这段时间每帧平均/最多分配的表面数和字节数，加上 memory_report()。
+    内存平稳时 cache_bytes 不超过预算、resident_bytes 不变、rss 在一个值附近，分配只来自缓存未命中
+    """
+    def __init__(self, path=None, interval=MEMORY_LOG_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.start = None
+        self.reset(None)
+
+    def reset(self, now):
+        self.last = now
+        self.frames = self.surfaces = self.surface_bytes = self.max_surfaces = 0
+
+    def __call__(self, record):
+        if self.start is None:
+            self.start = record["time"]
+            self.reset(record["time"])
+        self.frames += 1
+        self.surfaces += record["surfaces"]
+        self.surface_bytes += record["surface_bytes"]
+        self.max_surfaces = max(self.max_surfaces, record["surfaces"])
+        if record["time"] - self.last >= self.interval:
+            self.log(record)
+
+    def log(self, record):
+        frames = max(1, self.frames)
+        line = dict({"frame": record["frame"], "uptime_s": round(record["time"] - self.start, 1),
+                     "surfaces_per_frame": round(self.surfaces / frames, 3),
+                     "surface_bytes_per_frame": round(self.surface_bytes / frames),
+                     "max_surfaces_per_frame": self.max_surfaces}, **memory_report())
+        text = json.dumps(line, separators=(",", ":"))
+        if self.path is None:
+            print(text, file=sys.stderr, flush=True)
+        else:
+            with open(self.path, "a") as f:   # 每次重新打开，跑几天也不会一直占着文件
+                f.write(text + "\n")
+        self.reset(record["time"])
+
+    def close(self, record=None):
+        """退出时把最后一段也写出去"""
+        if record is not None and self.frames:
+            self.log(record)
+        remove_frame_hook(self)
+
+# --- 16. 协作式预热 ---
+# 缓存预热 (烘焙精灵、查字体) 拆成很多小步，每帧在 WARMUP_BUDGET_MS 的预算里推进几步，
+# 剩下的留到下一帧。网页版 (pygbag) 没有线程，一帧里同步做完所有烘焙会卡住整个标签页
+WARMUP_BUDGET_MS = 4.0   # 每帧留给预热任务的时间 (60 FPS 一帧约 16.7ms)
+
+class WarmupTasks:
+    """预热任务队列：每个任务是一个生成器，yield 一次算一小步；按加入的顺序做"""
+    def __init__(self):
+        self.tasks = deque()   # (名字, 生成器, 是否是第一帧之前必须完成的)
+        self.spent = {}        # 名字 -> 累计耗时 (毫秒)
+
+    def add(self, name, steps, required=False):
+        self.tasks.append((name, steps, required))
+        return self
+
+    @property
+    def done(self):
+        return not self.tasks
+
+    @property
+    def ready(self):
+        """第一帧要用的任务是否都做完了"""
+        return not any(required for _, _, required in self.tasks)
+
+    def run(self, budget_ms=WARMUP_BUDGET_MS):
+        """在预算内推进尽量多的步 (至少一步)，返回是否还有剩余任务"""
+        deadline = time.perf_counter() + budget_ms / 1000.0
+        while self.tasks:
+            name, steps, _ = self.tasks[0]
+            start = time.perf_counter()
+            try:
+                next(steps)
+            except StopIteration:
+                self.tasks.popleft()
+            self.spent[name] = self.spent.get(name, 0.0) + (time.perf_counter() - start) * 1000.0
+            if time.perf_counter() >= deadline:
+                break
+        return bool(self.tasks)
+
+def warm_static(scene, surface):
+    """植物叶片、静态图层和光照贴图 (第一帧就要用)"""
+    rooms = getattr(scene, "scenes", [scene])
+    for room in rooms:
+        for _, _, scale, angle in fiddle_leaf_layout(*room.room.plant_pos):
+            leaf_sprites.sprite(scale, angle)
+            yield
+        room.static_layers.ensure(surface)
+        yield
+    rooms[0].lighting.ensure(surface.get_size())
+    yield
+
+def warm_breath(scene):
+    for room in getattr(scene, "scenes", [scene]):
+        for cycle in (cat_breath_cycle(), dog_breath_cycle(room.room.dog_color)):
+            yield from cycle.build_steps()
+
+def warm_intro(scene):
+    """开场翻滚的帧 (翻滚本身一步才用一帧，预热很快就能跑到它前面)"""
+    room = getattr(scene, "scenes", [scene])[0]
+    roll = intro_roll(room.animation_speed)
+    for progress in roll.steps:
+        if room.progress >= 1.0:
+            return
+        if progress >= room.progress:
+            roll.frame(room, progress)
+            yield
+
+def warm_ui(scene):
+    """开场动画结束后才出现的东西：字体、按钮的各种状态、亲亲时的爱心"""
+    for spec in (BUTTON_FONT, KISS_FONT):
+        get_font(*spec)
+        yield
+    for btn in getattr(scene, "scenes", [scene])[0].buttons:
+        for state in BUTTON_STATES:
+            btn.sprite(state)
+            yield
+    for scale, alpha in heart_sprite_specs():
+        heart_sprite(scale, alpha)
+        yield
+
+def warmup_tasks(scene, surface):
+    return (WarmupTasks()
+            .add("static", warm_static(scene, surface), required=True)
+            .add("breath", warm_breath(scene), required=True)
+            .add("intro", warm_intro(scene))
+            .add("ui", warm_ui(scene)))
+
+# --- 17. 主程序 ---
+
+def main(**options):
+    """桌面版的阻塞入口：跑完异步主循环再退出 (参数见 main_async)"""
+    asyncio.run(main_async(**options))
     pygame.quit()
     sys.exit()
 
+async def main_async(dirty_rects=DIRTY_RECTS, hud=False, trace_path=None, fps=RENDER_FPS, rooms=1, wall_scale=None,
+                     refresh_budget=None, quality=QUALITY, adaptive=False, render_scale=None, atlas=True,
+                     startup_report=False, record_path=None, warmup_budget=WARMUP_BUDGET_MS, memory_log=None,
+                     memory_interval=MEMORY_LOG_INTERVAL):
+    """
+    主循环：每帧结束时 await 一次，把控制权交还给事件循环 (网页版里就是浏览器)
+    fps: 渲染帧率上限 (0 不限)，不影响游戏速度
+    rooms: 大于 1 时显示一面房间墙 (wall_scale 为空时缩放到铺满窗口，否则用滚轮滚动)
+    quality: 画质预设名，adaptive=True 时从这一档开始按帧耗时自动升降
+    atlas: 有可用的预烘焙图集时直接读入，省掉启动时的程序绘制
+    startup_report: 第一帧画完后把启动各阶段的耗时 (app.report()) 作为一行 JSON 打印出来
+    record_path: 把这一局的输入录进这个文件，之后可以用 run_replay() 重放
+    warmup_budget: 每帧留给缓存预热的毫秒数；第一帧要用的缓存预热完之前只预热、不画
+    memory_log: 每 memory_interval 秒追加一行内存汇总的文件 ("-" 为标准错误)，见 MemoryMonitor
+    """
+    screen = app.display()
+    recorder = None
+    if record_path:
+        seed = random.getrandbits(32)
+        random.seed(seed)
+        hour = local_hour() if default_lighting.time_of_day else None
+        recorder = InputRecorder(record_path, {
+            "seed": seed, "rooms": rooms, "wall_scale": wall_scale, "dirty_rects": dirty_rects,
+            "refresh_budget": refresh_budget, "quality": quality, "render_scale": render_scale, "hud": hud,
+            "hour": hour, "lamp": lamp_on()})
+        if hour is not None: default_lighting.clock = lambda: hour
+    def setup():
+        scene, renderer = create_scene(rooms, wall_scale, dirty_rects, refresh_budget, screen.get_size())
+        controller = QualityController(scene, renderer, quality, adaptive=adaptive, render_scale=render_scale)
+        return scene, renderer, controller
+    scene, renderer, controller = app.measure("scene", setup)
+    if atlas: app.measure("atlas", load_atlas)
+    timestep = FixedTimestep()
+    profiler = FrameProfiler(renderer)
+    perf_hud = PerfHUD(profiler, visible=hud)
+    renderer.overlays.append(perf_hud)
+    trace = add_frame_hook(RollingTrace(trace_path)) if trace_path else None
+    memory = None
+    if memory_log:
+        memory = add_frame_hook(MemoryMonitor(None if memory_log == "-" else memory_log, memory_interval))
+    warmup = warmup_tasks(scene, screen)
+    warmup_start = time.perf_counter()
+    while not warmup.ready:
+        warmup.run(warmup_budget)
+        pygame.event.pump()
+        await asyncio.sleep(0)
+    app.startup["warmup"] = round((time.perf_counter() - warmup_start) * 1000.0, 3)
+
+    running = True
+    sim_steps = 0   # 已经跑过的模拟步数，录制时用它给输入打时间戳
+    last_time = time.perf_counter()
+    while running:
+        profiler.begin_frame()
+        actions = []
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT: running = False
+            actions.extend(input_actions(event))
+        for action in actions:
+            if recorder: recorder.record(sim_steps, action, scene)
+            apply_action(scene, renderer, perf_hud, action)
+
+        now = time.perf_counter()
+        steps = timestep.advance((now - last_time) * 1000.0)
+        last_time = now
+        def simulate():
+            for _ in range(steps): scene.update()
+        profiler.time_update(simulate)
+        sim_steps += steps
+
+        # --- 绘图 (严格图层顺序) ---
+        if timestep.should_render():
+            if "first_frame" in app.startup:
+                renderer.render(screen, scene.view(timestep.alpha))
+            else:
+                app.measure("first_frame", renderer.render, screen, scene.view(timestep.alpha))
+                app.startup["ready"] = round((time.perf_counter() - IMPORT_START) * 1000.0, 3)
+                if startup_report: print(json.dumps(app.report()), flush=True)
+        profiler.end_frame(scene)
+        if recorder: recorder.record_quality(sim_steps, controller.preset.name, scene)
+        if not warmup.done: warmup.run(warmup_budget)
+        app.clock.tick(fps)
+        await asyncio.sleep(0)
+
+    if trace: trace.close()
+    if memory: memory.close(profiler.last_record)
+    if recorder: recorder.close(sim_steps, scene)
+
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="抱抱模拟器")
+    parser.add_argument("--dirty-rects", action="store_true", help="只刷新变化的区域")
+    parser.add_argument("--hud", action="store_true", help="启动时显示性能面板 (F3 切换)")
+    parser.add_argument("--time-of-day", action="store_true", help="按本地时间给光照加时段色调")
+    parser.add_argument("--lamp", action="store_true", help="打开床头灯 (多一个暖色光源)")
+    parser.add_argument("--fps", type=int, default=RENDER_FPS, help="渲染帧率上限，0 表示不限 (不影响游戏速度)")
+    parser.add_argument("--startup", action="store_true", help="第一帧画完后打印启动各阶段的耗时 (JSON)")
+    parser.add_argument("--record", metavar="FILE", help="把这一局的输入 (带时间戳) 和随机种子录进 FILE")
+    parser.add_argument("--replay", metavar="FILE", help="无窗口、不限帧率地重放录制，打印帧耗时统计 (JSON)")
+    parser.add_argument("--trace", help="把最近的每帧计时记录滚动写入该文件 (JSON Lines)")
+    parser.add_argument("--memory-log", metavar="FILE",
+                        help="每隔一段时间把表面分配和缓存占用的汇总追加到 FILE (JSON Lines，- 为标准错误)")
+    parser.add_argument("--memory-interval", type=float, default=MEMORY_LOG_INTERVAL, help="--memory-log 的间隔 (秒)")
+    parser.add_argument("--cache-budget", type=float, default=CACHE_BUDGET_MB, help="所有精灵缓存合计的内存上限 (MB)")
+    parser.add_argument("--rooms", type=int, default=1, help="同时显示的房间数 (大于 1 时铺成一面墙)")
+    parser.add_argument("--wall-scale", type=float, help="房间墙里每个房间的缩放比例 (不填则铺满窗口，填了可以用滚轮滚动)")
+    parser.add_argument("--refresh-budget", type=int, help="房间墙每帧最多重画几个房间，其余轮流更新 (默认全部重画)")
+    parser.add_argument("--quality", choices=[preset.name for preset in QUALITY_PRESETS], default=QUALITY,
+                        help="画质预设")
+    parser.add_argument("--adaptive", action="store_true", help="按帧耗时自动升降画质")
+    parser.add_argument("--render-scale", type=float, help="内部渲染比例 (覆盖画质预设，例如 0.5)")
+    parser.add_argument("--benchmark", action="store_true", help="无窗口基准测试，输出 JSON")
+    parser.add_argument("--stress", action="store_true", help="基准测试改为多房间压力测试 (1/10/100 个房间)")
+    parser.add_argument("--frames", type=int, default=BENCH_FRAMES, help="基准测试每个阶段的帧数")
+    parser.add_argument("--out", help="基准测试结果写入的文件 (默认输出到终端)")
+    parser.add_argument("--bake-atlas", action="store_true", help="把程序绘制的精灵烘焙成图集 (构建时运行)")
+    parser.add_argument("--no-atlas", action="store_true", help="不读图集，全部现画")
+    parser.add_argument("--export", metavar="DIR", help="无窗口导出剧本动画的 PNG 序列到 DIR")
+    parser.add_argument("--video", help="把导出的帧交给 ffmpeg 编码成视频或 GIF")
+    parser.add_argument("--seconds", type=float, default=EXPORT_SECONDS, help="导出的时长 (秒)")
+    parser.add_argument("--start", type=int, default=0, help="导出的第一帧")
+    parser.add_argument("--end", type=int, help="导出到这一帧为止 (不含，覆盖 --seconds)")
+    parser.add_argument("--export-fps", type=int, default=SIM_HZ, help="导出帧率")
+    parser.add_argument("--workers", type=int, help="导出用的进程数 (默认 CPU 核数)")
+    parser.add_argument("--seed", type=int, default=EXPORT_SEED, help="导出用的随机种子")
+    return parser.parse_args(argv)
+
+app.startup["import"] = round((time.perf_counter() - IMPORT_START) * 1000.0, 3)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    cache_budget.set_limit(args.cache_budget)
+    if args.bake_atlas:
+        print(json.dumps(bake_atlas(), indent=2))
+        pygame.quit()
+    elif args.benchmark or args.replay:
+        if args.replay:
+            result = run_replay(args.replay, atlas=not args.no_atlas)
+        elif args.stress:
+            result = run_room_benchmark(frames=args.frames, refresh_budget=args.refresh_budget)
+        else:
+            result = run_benchmark(args.frames, args.dirty_rects, quality=args.quality, render_scale=args.render_scale,
+                                   atlas=not args.no_atlas)
+        result = json.dumps(result, indent=2)
+        if args.out:
+            with open(args.out, "w") as f: f.write(result + "\n")
+        else:
+            print(result)
+        pygame.quit()
+    elif args.export or args.video:
+        print(json.dumps(export_frames(args.export, args.video, args.seconds, args.start, args.end, args.export_fps,
+                                       args.workers, args.seed, args.quality), indent=2))
+        pygame.quit()
+    else:
+        default_lighting.time_of_day = args.time_of_day
+        set_lamp(args.lamp)
+        options = dict(dirty_rects=args.dirty_rects, hud=args.hud, trace_path=args.trace, fps=args.fps,
+                       rooms=args.rooms, wall_scale=args.wall_scale, refresh_budget=args.refresh_budget,
+                       quality=args.quality, adaptive=args.adaptive, render_scale=args.render_scale,
+                       atlas=not args.no_atlas, startup_report=args.startup, record_path=args.record,
+                       memory_log=args.memory_log, memory_interval=args.memory_interval)
+        if sys.platform == "emscripten":   # 浏览器里 (pygbag) 不能阻塞
+            asyncio.run(app.run_async(**options))
+        else:
+            app.run(**options)